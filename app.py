@@ -1,5 +1,17 @@
 import streamlit as st
 
+from dataset.metrics import PROMETHEUS_PORT, enable as enable_metrics
+from llm import LLM_ENABLED, warm_up as warm_up_llm
+
+# Stage timings and cache counters, scraped from http://127.0.0.1:9464/metrics when enabled
+METRICS = False
+if METRICS:
+    enable_metrics(prometheus_port=PROMETHEUS_PORT)
+
+# Start loading the model in the background as soon as the server handles its first session
+if LLM_ENABLED:
+    warm_up_llm()
+
 overview = st.Page("pages/overview.py", title="Overview", icon=":material/travel_explore:")
 simulator = st.Page("pages/simulator.py", title="Budget Simulator", icon=":material/attach_money:")
 
@@ -0,0 +1,50 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing import (
+    BUDGET_DEFAULT,
+    FILEPATH_PRICES_PROCESSED,
+    estimate_monthly_budget,
+    estimate_monthly_budget_df,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+SIZES = [190, 10_000, 100_000]
+REPEATS = 3
+
+def make_synthetic_prices(df: pd.DataFrame, n_rows, seed=0):
+    # Resample the real cities and jitter every numeric column by +/-10%
+    rng = np.random.default_rng(seed)
+    synthetic = df.iloc[rng.integers(0, len(df), n_rows)].reset_index(drop=True)
+    numeric_cols = synthetic.select_dtypes(include=["number"]).columns
+    synthetic[numeric_cols] = synthetic[numeric_cols] * rng.uniform(0.9, 1.1, (n_rows, len(numeric_cols)))
+    synthetic["City"] = synthetic["City"] + "_" + synthetic.index.astype(str)
+    return synthetic
+
+def best_of(func, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+if __name__ == "__main__":
+    df = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+    for n_rows in SIZES:
+        df_synthetic = df if n_rows == len(df) else make_synthetic_prices(df, n_rows)
+        # The row-wise apply is slow enough that a single run is representative on large inputs
+        t_apply, budget_apply = best_of(
+            lambda: df_synthetic.apply(estimate_monthly_budget, budget_default=BUDGET_DEFAULT, axis=1, result_type="expand"),
+            repeats=1 if n_rows > 10_000 else REPEATS,
+        )
+        t_vectorized, budget_vectorized = best_of(lambda: estimate_monthly_budget_df(df_synthetic, BUDGET_DEFAULT))
+        pd.testing.assert_frame_equal(budget_apply, budget_vectorized, check_exact=True)
+        logging.info(
+            f"{n_rows:>7} rows: apply {t_apply * 1000:9.1f} ms | vectorized {t_vectorized * 1000:7.2f} ms | "
+            f"speedup x{t_apply / t_vectorized:.0f}"
+        )
@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing import FILEPATH_PRICES_RAW
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+N_ROWS = 1_000_000
+
+# Each mode runs in a fresh interpreter so peak RSS belongs to that mode alone
+INGEST = """
+import json, resource, sys, time
+import pandas as pd
+from dataset.preprocessing import clean_prices_df, read_prices_chunked
+start = time.perf_counter()
+if sys.argv[1] == "full":
+    df = clean_prices_df(pd.read_csv(sys.argv[2]))
+else:
+    df = read_prices_chunked(sys.argv[2])
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "kept": len(df), "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+def make_synthetic_dump(path, n_rows, seed=0):
+    # Worldwide-style dump: resampled raw rows with jittered prices, written in pieces to keep this process small
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(FILEPATH_PRICES_RAW)
+    price_cols = [f"x{i}" for i in range(1, 56)]
+    for start in range(0, n_rows, 100_000):
+        piece = df.iloc[rng.integers(0, len(df), min(100_000, n_rows - start))].reset_index(drop=True)
+        piece[price_cols] = (piece[price_cols] * rng.uniform(0.9, 1.1, (len(piece), len(price_cols)))).round(2)
+        piece.to_csv(path, mode="a", header=start == 0, index=False)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prices_raw_big.csv")
+        make_synthetic_dump(path, N_ROWS)
+        logging.info(f"Synthetic dump: {N_ROWS} rows, {os.path.getsize(path) / 1024 ** 2:.0f} MiB")
+        for mode in ["full", "chunked"]:
+            output = subprocess.run([sys.executable, "-c", INGEST, mode, path], capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            logging.info(
+                f"{mode:>8}: {result['seconds']:.2f}s ({N_ROWS / result['seconds']:.0f} rows/s), "
+                f"kept {result['kept']}, peak RSS {result['peak_rss_kb'] / 1024:.0f} MiB"
+            )
@@ -0,0 +1,28 @@
+import logging
+import time
+
+import pandas as pd
+
+from dataset.geocoding import FakeGeolocator, geocode_pairs
+from dataset.preprocessing import EU_COUNTRIES, FILEPATH_PRICES_RAW
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+LATENCY = 0.01  # seconds per fake round trip
+WORKERS = [1, 4, 16]
+
+if __name__ == "__main__":
+    df = pd.read_csv(FILEPATH_PRICES_RAW)
+    df = df[df["country"].isin(EU_COUNTRIES)]
+    pairs = list(zip(df["city"], df["country"]))
+    logging.info(f"{len(pairs)} rows, {len(set(pairs))} distinct (city, country) pairs")
+
+    for workers in WORKERS:
+        start = time.perf_counter()
+        geocode_pairs(pairs, FakeGeolocator(latency=LATENCY), max_workers=workers, requests_per_second=None)
+        logging.info(f"{workers:>3} workers: {time.perf_counter() - start:.2f}s")
+
+    # With the Nominatim policy of 1 request/s the limiter, not the pool, bounds throughput
+    start = time.perf_counter()
+    geocode_pairs(pairs[:20], FakeGeolocator(latency=LATENCY), max_workers=4, requests_per_second=10)
+    logging.info(f"20 rows at 10 requests/s: {time.perf_counter() - start:.2f}s")
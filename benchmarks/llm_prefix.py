@@ -0,0 +1,59 @@
+import logging
+
+import pandas as pd
+
+from benchmarks.budget_engine import best_of
+from dataset.preprocessing import FILEPATH_PRICES_PROCESSED, calculate_budget_df
+from llm import FUN_FACT_TEMPLATE, PROMPT_PREFIXES, SUMMARY_TEMPLATE, _fun_fact_inputs
+from llm_digest import build_digest
+from llm_prefix import PrefixCache
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Needs torch and transformers; any small causal LM from the Hub or a local path will do
+MODEL_NAME = "HuggingFaceTB/SmolLM2-135M"
+SIZES = [10, 190]
+DIGEST_TOKENS = [150, 600]
+
+def prefill_seconds(model, prefix_cache, prompt, reuse):
+    # One forward pass over the prompt, as generate() runs before the first new token. With reuse
+    # only the tokens after the cached prefix go through the model; the timing includes the copy
+    # of the cached prefix that every generation makes
+    import torch
+
+    input_ids, cache = prefix_cache.inputs(prompt)
+    cached = cache.get_seq_length() if reuse and cache is not None else 0
+
+    def prefill():
+        with torch.no_grad():
+            if cached:
+                model(input_ids=input_ids[:, cached:], past_key_values=prefix_cache.inputs(prompt)[1], use_cache=True)
+            else:
+                model(input_ids=input_ids, use_cache=True)
+
+    return best_of(prefill)[0], input_ids.shape[-1], cached
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForCausalLM.from_pretrained(MODEL_NAME).eval()
+    prefix_cache = PrefixCache(model, tokenizer, PROMPT_PREFIXES)
+    prefix_cache.warm_up()
+
+    df_prices = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+    for n_rows in SIZES:
+        df = calculate_budget_df(df_prices.head(n_rows))
+        for max_tokens in DIGEST_TOKENS:
+            data = build_digest(df, max_tokens=max_tokens, tokenizer=tokenizer)
+            prompts = {
+                "summary": SUMMARY_TEMPLATE.format(data=data, page_context="the budget simulator"),
+                "fun_fact": FUN_FACT_TEMPLATE.format(**_fun_fact_inputs(data, "the budget simulator")),
+            }
+            for name, prompt in prompts.items():
+                t_full, n_tokens, _ = prefill_seconds(model, prefix_cache, prompt, reuse=False)
+                t_reuse, _, n_cached = prefill_seconds(model, prefix_cache, prompt, reuse=True)
+                logging.info(
+                    f"{n_rows:>4} rows, digest <= {max_tokens:>3} tokens, {name:>8}: {n_tokens:>4} prompt tokens, "
+                    f"{n_cached:>3} cached | prefill {t_full * 1000:7.1f} ms full vs {t_reuse * 1000:7.1f} ms with prefix reuse"
+                )
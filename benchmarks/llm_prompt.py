@@ -0,0 +1,53 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from benchmarks.budget_engine import best_of, make_synthetic_prices
+from dataset.preprocessing import FILEPATH_PRICES_PROCESSED, calculate_budget_df
+from llm_digest import build_digest, estimate_tokens
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+SIZES = [10, 190, 1_000, 10_000]
+# Set to a tokenizer from the Hub or a local path (needs transformers) to count and time the real
+# encoding of the prompts; without one the counts are the chars-per-token estimate of llm_digest
+TOKENIZER_NAME = None
+# Set to True where torch/transformers and the model are available to time real generation too
+GENERATE = False
+
+def generation_seconds(prompt):
+    from llm import _stream_via_queue
+
+    start = time.perf_counter()
+    _stream_via_queue(prompt, None, threading.Event())
+    return time.perf_counter() - start
+
+def prepare_seconds(make_text, tokenizer):
+    # Building the prompt text plus encoding it, the work done before the model sees the prompt
+    return best_of(lambda: estimate_tokens(make_text(), tokenizer))
+
+if __name__ == "__main__":
+    tokenizer = None
+    if TOKENIZER_NAME is not None:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    logging.info(
+        f"Prompt preparation time, {'tokens from ' + TOKENIZER_NAME if tokenizer else 'estimated token counts'}"
+        f"{', generation time' if GENERATE else ' (no model generation: set GENERATE = True to time it)'}"
+    )
+    df_prices = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+    for name, make_frame in [("prices", lambda df: df), ("budget", calculate_budget_df)]:
+        for n_rows in SIZES:
+            df = make_frame(df_prices.head(n_rows) if n_rows <= len(df_prices) else make_synthetic_prices(df_prices, n_rows))
+            t_raw, raw_tokens = prepare_seconds(lambda: df.to_string(), tokenizer)
+            t_digest, digest_tokens = prepare_seconds(lambda: build_digest(df, tokenizer=tokenizer), tokenizer)
+            message = (
+                f"{name:>6} {n_rows:>6} rows: to_string {raw_tokens:>9} tokens prepared in {t_raw * 1000:8.1f} ms | "
+                f"digest {digest_tokens:>4} tokens prepared in {t_digest * 1000:6.1f} ms"
+            )
+            if GENERATE:
+                message += f" | generation {generation_seconds(df.to_string()):.1f}s vs {generation_seconds(build_digest(df)):.1f}s"
+            logging.info(message)
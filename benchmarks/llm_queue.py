@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from llm_queue import FakeBackend, InferenceQueue, InferenceRequest, QueueFull, TransformersBackend
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+SESSIONS = [1, 4, 16]
+BATCH_SIZES = [1, 4]
+REQUESTS_PER_SESSION = 3
+MAX_NEW_TOKENS = 32
+PROMPT = "x" * 2400  # about the size of a digest prompt
+# FakeBackend's per-step and per-batch costs are made up: with it the run checks the queue's
+# fairness and backpressure, not the speedup of batching. Set MODEL_NAME to a small local causal
+# LM (needs torch and transformers) to measure throughput on the real backend.
+MODEL_NAME = None
+
+def make_backend():
+    if MODEL_NAME is None:
+        return FakeBackend()
+    # The app's own generation functions, with the model loaded as the app loads it
+    import llm
+
+    llm.MODEL_NAME = MODEL_NAME
+    llm._load_llm()
+    return TransformersBackend(llm._stream_pipeline, llm._stream_batch_pipeline)
+
+def run_sessions(queue, n_sessions):
+    # Each session sends its prompts one after the other, like a user waiting for each answer
+    latencies, first_tokens, rejected = [], [], []
+    lock = threading.Lock()
+
+    def session(session_id):
+        for _ in range(REQUESTS_PER_SESSION):
+            first_token = []
+            request = InferenceRequest(PROMPT, session_id, MAX_NEW_TOKENS, on_text=lambda text: first_token or first_token.append(time.perf_counter()))
+            try:
+                queue.submit(request).wait()
+            except QueueFull:
+                with lock:
+                    rejected.append(session_id)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - request.submitted_at)
+                # A real model may end at once without any text
+                if first_token:
+                    first_tokens.append(first_token[0] - request.submitted_at)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(n_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, first_tokens, rejected
+
+if __name__ == "__main__":
+    backend = make_backend()
+    if MODEL_NAME is None:
+        logging.info("Simulated backend: the req/s below come from FakeBackend's made-up cost model, not from a model")
+    else:
+        logging.info(f"Model {MODEL_NAME} through TransformersBackend")
+    for max_batch in BATCH_SIZES:
+        for n_sessions in SESSIONS:
+            queue = InferenceQueue(backend, max_batch=max_batch)
+            elapsed, latencies, first_tokens, rejected = run_sessions(queue, n_sessions)
+            logging.info(
+                f"batch {max_batch} | {n_sessions:>2} sessions: {len(latencies) / elapsed:5.1f} req/s, "
+                f"latency p50 {np.percentile(latencies, 50):.2f}s p95 {np.percentile(latencies, 95):.2f}s, "
+                f"first token p50 {np.percentile(first_tokens, 50) if first_tokens else np.nan:.2f}s, "
+                f"{queue.batches} batches, {len(rejected)} rejected"
+            )
+
+    # Backpressure: with a short queue a burst beyond its capacity is rejected at once instead of piling up
+    queue = InferenceQueue(backend, max_queue=8, max_batch=4)
+    elapsed, latencies, first_tokens, rejected = run_sessions(queue, 32)
+    logging.info(f"burst of 32 sessions on a queue of 8: {len(latencies)} served, {len(rejected)} rejected in {elapsed:.2f}s")
@@ -0,0 +1,44 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+import overview_figures
+from benchmarks.budget_engine import best_of
+from overview_figures import map_figure
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+SIZES = [190, 5_000, 50_000, 200_000]
+COLUMN = "Monthly Savings over Income"
+
+def make_world_cities(n_cities, seed=0):
+    # Cities clustered around random centers on every continent, like a worldwide dataset
+    rng = np.random.default_rng(seed)
+    centers = np.column_stack([rng.uniform(-45, 65, 400), rng.uniform(-150, 150, 400)])
+    picked = centers[rng.integers(0, len(centers), n_cities)]
+    return pd.DataFrame({
+        "Country": "Country " + (rng.integers(0, 150, n_cities)).astype(str),
+        "City": "City " + pd.RangeIndex(n_cities).astype(str),
+        "Latitude": np.clip(picked[:, 0] + rng.normal(0, 2, n_cities), -80, 80),
+        "Longitude": picked[:, 1] + rng.normal(0, 3, n_cities),
+        COLUMN: rng.normal(20, 15, n_cities).round(2),
+    })
+
+def render(df, webgl_min_points):
+    # Figure construction plus the JSON spec Streamlit sends to the browser, on a cache miss
+    overview_figures.MAP_WEBGL_MIN_POINTS = webgl_min_points
+    overview_figures.figure_cache.clear()
+    fig = map_figure("benchmark", df, "City", "Saving Rate", COLUMN, [], None, df["Latitude"].max() - df["Latitude"].min())
+    return len(fig.data[0].lat), pio.to_json(fig.to_dict(), validate=False)
+
+if __name__ == "__main__":
+    for n_cities in SIZES:
+        df = make_world_cities(n_cities)
+        t_svg, (_, spec_svg) = best_of(lambda: render(df, np.inf))
+        t_webgl, (markers, spec_webgl) = best_of(lambda: render(df, 0))
+        logging.info(
+            f"{n_cities:>7} cities: scatter_geo {t_svg * 1000:7.1f} ms, {len(spec_svg) / 1024:8.0f} KiB | "
+            f"thinned scattermap {t_webgl * 1000:7.1f} ms, {len(spec_webgl) / 1024:6.0f} KiB, {markers} markers"
+        )
@@ -0,0 +1,35 @@
+import logging
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.chunked_ingest import make_synthetic_dump
+from dataset.geocoding import FakeGeolocator, GeoCache
+from dataset.preprocessing import process_df
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+N_ROWS = 500_000
+WORKERS = [1, 2, 4, 8]
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prices_raw_big.csv")
+        make_synthetic_dump(path, N_ROWS)
+        df_raw = pd.read_csv(path)
+        # Warm geocoding cache shared by every run, so the timings cover cleaning and aggregation only
+        geo_cache = GeoCache(os.path.join(tmp, "geocache.sqlite"))
+        geo_options = dict(geolocator=FakeGeolocator(), geo_cache=geo_cache, offline_reverse=False, geocoding_requests_per_second=None)
+        process_df(df_raw, **geo_options)
+
+        df_sequential = None
+        for workers in WORKERS:
+            start = time.perf_counter()
+            df = process_df(df_raw, workers=workers, **geo_options)
+            elapsed = time.perf_counter() - start
+            if df_sequential is None:
+                df_sequential = df
+            identical = df.equals(df_sequential)
+            logging.info(f"{workers:>2} workers: {elapsed:.2f}s, {len(df)} cities, identical to sequential: {identical}")
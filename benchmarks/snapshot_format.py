@@ -0,0 +1,54 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+
+from benchmarks.budget_engine import make_synthetic_prices
+from dataset.preprocessing import FILEPATH_PRICES_PROCESSED
+from dataset.snapshot import write_snapshot
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+SIZES = [190, 100_000]
+
+# Each load runs in a fresh interpreter so memory is not polluted by the previous one.
+# RssAnon is private to the process; RssFile (the mapped snapshot) is shared page cache.
+LOADER = """
+import json, sys, time
+import pandas as pd
+from dataset.snapshot import read_snapshot
+def rss():
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return {key: int(fields[key].split()[0]) for key in ("RssAnon", "RssFile")}
+baseline = rss()
+start = time.perf_counter()
+df = pd.read_csv(sys.argv[2]) if sys.argv[1] == "csv" else read_snapshot(sys.argv[2])
+df["City"].nunique(), df.iloc[:, 4:].mean()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, **{key: value - baseline[key] for key, value in rss().items()}}))
+"""
+
+def measure(kind, path):
+    output = subprocess.run([sys.executable, "-c", LOADER, kind, path], capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+if __name__ == "__main__":
+    df = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_rows in SIZES:
+            df_synthetic = df if n_rows == len(df) else make_synthetic_prices(df, n_rows)
+            csv_path = os.path.join(tmp, f"prices_{n_rows}.csv")
+            snapshot_path = os.path.join(tmp, f"prices_{n_rows}.snapshot")
+            df_synthetic.to_csv(csv_path, index=False)
+            write_snapshot(df_synthetic, snapshot_path)
+            for kind, path in [("csv", csv_path), ("snapshot", snapshot_path)]:
+                result = measure(kind, path)
+                logging.info(
+                    f"{n_rows:>7} rows {kind:>8}: load+scan {result['seconds'] * 1000:8.1f} ms | "
+                    f"private RSS +{result['RssAnon'] / 1024:6.1f} MiB | shared file RSS +{result['RssFile'] / 1024:6.1f} MiB"
+                )
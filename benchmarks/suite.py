@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.budget_engine import best_of, make_synthetic_prices
+from dataset.geocoding import FakeGeolocator, GeoCache
+from dataset.overview_index import OverviewIndex
+from dataset.preprocessing import (
+    BUDGET_DEFAULT,
+    EU_COUNTRIES,
+    FILEPATH_PRICES_PROCESSED,
+    FILEPATH_PRICES_RAW,
+    calculate_budget_df,
+    estimate_monthly_budget,
+    process_df,
+)
+from dataset.snapshot import read_snapshot, write_snapshot
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Repeatable timings of the hot paths on synthetic datasets scaled from the real ~190-city file.
+# Results are written as JSON and can be compared against a stored baseline, e.g.
+#   python -m benchmarks.suite --output results.json --baseline benchmarks/baseline.json
+# exits with status 1 when a case got slower than REGRESSION_THRESHOLD times its baseline.
+# benchmarks/baseline.json is refreshed with --output when a change is meant to move the numbers;
+# timings only compare on the same machine.
+
+SIZES = [190, 10_000, 100_000]
+REPEATS = 3
+REGRESSION_THRESHOLD = 1.25
+REGRESSION_MIN_SECONDS = 0.005  # differences below this are timer noise
+
+OVERVIEW_COLUMN = "Monthly Savings over Income"
+OVERVIEW_COUNTRIES = ["Italy", "Germany", "France", "Spain"]
+
+def make_synthetic_raw(n_cities, seed=0):
+    # Raw-dump rows of EU cities, resampled and renamed so each row is its own city
+    rng = np.random.default_rng(seed)
+    df = pd.read_csv(FILEPATH_PRICES_RAW)
+    df = df[df["country"].isin(EU_COUNTRIES) & (df["data_quality"] == 1)].dropna()
+    synthetic = df.iloc[rng.integers(0, len(df), n_cities)].reset_index(drop=True)
+    synthetic["city"] = synthetic["city"] + "_" + synthetic.index.astype(str)
+    return synthetic
+
+def overview_pandas(df, column=OVERVIEW_COLUMN, countries=OVERVIEW_COUNTRIES):
+    # The filter/groupby/sort sequence the Overview page ran before the precomputed index
+    df = df[df["Country"].isin(countries)]
+    df = df[df[column].between(df[column].min(), df[column].max() + 1E-6)]
+    df = df.groupby("City").agg({"City": "first", "Country": "first", "Latitude": "first", "Longitude": "first", column: "mean"})
+    df = df.reset_index(drop=True).sort_values(column, ascending=False).reset_index(drop=True).rename(index=lambda x: x + 1)
+    df[column] = df[column].round(2)
+    return df
+
+def overview_index(df, column=OVERVIEW_COLUMN, countries=OVERVIEW_COUNTRIES):
+    index = OverviewIndex(df)
+    return index.query(column, "City", countries, index.value_bounds(column, countries))
+
+def run_suite(sizes, repeats=REPEATS):
+    df_prices = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+    results = {}
+
+    def record(case, n_cities, func, case_repeats=None):
+        # Library logging (snapshot writes, geocoding cache stats) is muted while timing
+        logging.disable(logging.INFO)
+        seconds, _ = best_of(func, repeats=case_repeats or repeats)
+        logging.disable(logging.NOTSET)
+        results.setdefault(case, {})[str(n_cities)] = seconds
+        logging.info(f"{case:>28} {n_cities:>7} cities: {seconds * 1000:10.2f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_cities in sizes:
+            df = df_prices if n_cities == len(df_prices) else make_synthetic_prices(df_prices, n_cities)
+            # The row-wise apply is slow enough that a single run is representative on large inputs
+            slow_repeats = 1 if n_cities > 10_000 else None
+
+            record("estimate_monthly_budget", n_cities, lambda: df.apply(
+                estimate_monthly_budget, budget_default=BUDGET_DEFAULT, axis=1, result_type="expand"
+            ), slow_repeats)
+            record("calculate_budget_df", n_cities, lambda: calculate_budget_df(df, BUDGET_DEFAULT))
+
+            df_raw = make_synthetic_raw(n_cities)
+            geo_cache = GeoCache(os.path.join(tmp, f"geocache_{n_cities}.sqlite"))
+            geo_options = dict(geolocator=FakeGeolocator(), geo_cache=geo_cache, offline_reverse=False, geocoding_requests_per_second=None)
+            record("process_df (cold geocache)", n_cities, lambda: process_df(df_raw, **geo_options), 1)
+            record("process_df (warm geocache)", n_cities, lambda: process_df(df_raw, **geo_options), slow_repeats)
+
+            df_budget = calculate_budget_df(df, BUDGET_DEFAULT)
+            csv_path = os.path.join(tmp, f"budget_{n_cities}.csv")
+            snapshot_path = os.path.join(tmp, f"budget_{n_cities}.snapshot")
+            df_budget.to_csv(csv_path, index=False)
+            write_snapshot(df_budget, snapshot_path)
+            record("load csv", n_cities, lambda: pd.read_csv(csv_path))
+            record("load snapshot", n_cities, lambda: read_snapshot(snapshot_path))
+
+            record("overview pandas", n_cities, lambda: overview_pandas(df_budget))
+            record("overview index (build+query)", n_cities, lambda: overview_index(df_budget))
+            index = OverviewIndex(df_budget)
+            record("overview index (query)", n_cities, lambda: index.query(
+                OVERVIEW_COLUMN, "City", OVERVIEW_COUNTRIES, index.value_bounds(OVERVIEW_COLUMN, OVERVIEW_COUNTRIES)
+            ))
+
+    return {
+        "meta": {
+            "timestamp": pd.Timestamp.now(tz="UTC").isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    # Rows of (case, cities, baseline s, current s, ratio, regression) for cases present in both runs
+    rows = []
+    for case, timings in current["results"].items():
+        for n_cities, seconds in timings.items():
+            reference = baseline["results"].get(case, {}).get(n_cities)
+            if reference is None:
+                continue
+            ratio = seconds / reference
+            regression = ratio > threshold and seconds - reference > REGRESSION_MIN_SECONDS
+            rows.append((case, int(n_cities), reference, seconds, ratio, regression))
+    return pd.DataFrame(rows, columns=["case", "cities", "baseline s", "current s", "ratio", "regression"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing and budget hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="synthetic dataset sizes, in cities")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    current = run_suite(args.sizes, args.repeats)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=1)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        df_comparison = compare(current, baseline, args.threshold)
+        print(df_comparison.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+        if df_comparison["regression"].any():
+            sys.exit(1)
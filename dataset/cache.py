@@ -0,0 +1,78 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from dataset.metrics import increment
+
+def canonical_hash(value):
+    # Stable hash of a JSON-like value, independent of dict key order
+    canonical = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+def _size_of(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    return 0
+
+class LRUCache:
+    # Thread-safe in-memory LRU bounded by entry count and by approximate size in bytes.
+    # Stored values are shared between callers and must be treated as read-only.
+    # With a name, hits/misses/evictions are also reported as cache.<name>.* metrics.
+
+    def __init__(self, max_entries, max_bytes=None, name=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._count("hits")
+                return self._entries[key][0]
+            self.misses += 1
+            self._count("misses")
+        # Computed outside the lock so slow misses don't block hits from other sessions
+        value = compute()
+        size = _size_of(value)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.size_bytes += size
+                while self._entries and (
+                    len(self._entries) > self.max_entries or (self.max_bytes is not None and self.size_bytes > self.max_bytes)
+                ):
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.size_bytes -= evicted_size
+                    self.evictions += 1
+                    self._count("evictions")
+        return value
+
+    def _count(self, event):
+        if self.name is not None:
+            increment(f"cache.{self.name}.{event}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
@@ -0,0 +1,104 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing import BUDGET_DEFAULT, calculate_budget_df
+from dataset.snapshot import load_dataset
+
+# Opt-in compact schema for the in-memory frames. Float columns are held as float32 in one
+# contiguous row-major matrix with a column name -> position index (PriceMatrix; the frame's
+# columns are views into it), string columns as categoricals and integer columns at the smallest
+# width that fits. Float columns with values of COMPACT_MAX_EXACT or more stay float64, outside
+# the matrix, so the tolerance below holds for every column.
+#
+# Rounding tolerance: float32 keeps 24 significant bits, so a value |x| < 2**17 = 131072 is off by
+# at most |x| * 2**-24 < 0.004 after the conversion, below the 0.005 half-step of the .round(2)
+# values in the processed datasets. Rounding the float32 value back to 2 decimals in float64
+# therefore returns exactly the stored value; the largest value in the datasets is ~44000.
+# calculate_budget_df upcasts its inputs with to_numpy(dtype=float), so budgets computed from
+# compact prices still run in float64; only the prices they start from carry the float32
+# representation error. compact_error measures the largest absolute difference per column after
+# rounding the compact values to 2 decimals: 0 for the stored datasets, and up to 0.01 (one step
+# of the last decimal, where a budget lands next to a rounding boundary) for a budget frame
+# computed from compact prices and stored compact.
+
+COMPACT_FLOAT_DTYPE = np.float32
+COMPACT_MAX_EXACT = 2 ** 17
+
+PriceMatrix = namedtuple("PriceMatrix", ["values", "columns"])
+
+def price_matrix(df: pd.DataFrame, columns=None):
+    # Float columns of a frame as one contiguous row-major float32 matrix plus a name -> column
+    # position index; by default every float column whose values fit the float32 tolerance
+    if columns is None:
+        columns = [
+            column for column in df.columns
+            if pd.api.types.is_float_dtype(df[column]) and not (df[column].abs() >= COMPACT_MAX_EXACT).any()
+        ]
+    values = df[columns].to_numpy(dtype=COMPACT_FLOAT_DTYPE)
+    return PriceMatrix(np.ascontiguousarray(values), {column: i for i, column in enumerate(columns)})
+
+def compact_df(df: pd.DataFrame, matrix=None):
+    # matrix is the frame's PriceMatrix when the caller keeps it, see dataset/store.py
+    matrix = price_matrix(df) if matrix is None else matrix
+    # Built from a single 2D array, the matrix columns form one pandas block backed by matrix.values
+    df_compact = pd.DataFrame(matrix.values, columns=list(matrix.columns), copy=False)
+    for i, column in enumerate(df.columns):
+        if column in matrix.columns:
+            continue
+        values = df[column].reset_index(drop=True)
+        if pd.api.types.is_float_dtype(values):
+            # Too large for the float32 tolerance
+            values = values.astype(float)
+        elif pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast="integer")
+        elif not pd.api.types.is_numeric_dtype(values):
+            values = values.astype("category")
+        # Inserted in column order, so every column lands at its original position
+        df_compact.insert(i, column, values)
+    return df_compact
+
+
+def compact_error(df: pd.DataFrame, df_compact: pd.DataFrame):
+    # Largest absolute difference per float column after rounding the compact values back to 2 decimals
+    errors = {}
+    for column in df.columns:
+        if pd.api.types.is_float_dtype(df[column]):
+            restored = df_compact[column].to_numpy(dtype=float).round(2)
+            errors[column] = float(np.nanmax(np.abs(restored - df[column].to_numpy(dtype=float)), initial=0))
+    return pd.Series(errors, dtype=float)
+
+def memory_report(df: pd.DataFrame, df_compact: pd.DataFrame):
+    report = pd.DataFrame({
+        "dtype": df.dtypes.astype(str),
+        "bytes": df.memory_usage(deep=True, index=False),
+        "compact dtype": df_compact.dtypes.astype(str),
+        "compact bytes": df_compact.memory_usage(deep=True, index=False),
+    })
+    report.loc["Total"] = ["", report["bytes"].sum(), "", report["compact bytes"].sum()]
+    report["saved %"] = (100 * (1 - report["compact bytes"] / report["bytes"])).round(1)
+    return report
+
+if __name__ == "__main__":
+    from dataset.store import DATASETS
+
+    for name, (snapshot_path, csv_path) in DATASETS.items():
+        df = load_dataset(snapshot_path, csv_path)
+        df_compact = compact_df(df)
+        report = memory_report(df, df_compact)
+        logging.info(f"{name}: {len(df)} rows\n{report.to_string()}")
+        logging.info(f"{name}: max error after rounding {compact_error(df, df_compact).max():.4f}")
+
+    # Every session with a custom budget holds one budget frame derived from the prices
+    df_prices = load_dataset(*DATASETS["prices"])
+    df_budget = calculate_budget_df(df_prices, BUDGET_DEFAULT)
+    df_budget_compact = compact_df(calculate_budget_df(compact_df(df_prices), BUDGET_DEFAULT))
+    per_session = df_budget.memory_usage(deep=True).sum()
+    per_session_compact = df_budget_compact.memory_usage(deep=True).sum()
+    logging.info(
+        f"Per-session budget frame: {per_session / 1024:.1f} KiB -> {per_session_compact / 1024:.1f} KiB "
+        f"({100 * (1 - per_session_compact / per_session):.1f}% saved), "
+        f"max budget difference {compact_error(df_budget, df_budget_compact).max():.4f}"
+    )
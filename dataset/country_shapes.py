@@ -0,0 +1,93 @@
+import json
+import logging
+import threading
+
+from dataset.gazetteer import COUNTRY_CODES
+
+# Country geometry for the Country choropleth. Countries are drawn from Plotly's built-in 1:110m
+# world geometry by ISO 3166-1 alpha-3 code (locationmode="ISO-3"), so the figure carries no
+# outlines and no country names are matched. Countries too small for that scale have no feature
+# there (Malta); their outlines are bundled here, keyed by the lowercase alpha-2 country_code used
+# by preprocessing, and drawn as a second trace on the same color axis.
+
+FILEPATH_COUNTRY_SHAPES = "dataset/small_countries.geojson"
+
+# Alpha-3 codes of the country_code values (gazetteer COUNTRY_CODES), for locationmode="ISO-3"
+COUNTRY_ISO3 = {
+    "at": "AUT", "be": "BEL", "bg": "BGR", "hr": "HRV", "cy": "CYP", "cz": "CZE", "dk": "DNK",
+    "ee": "EST", "fi": "FIN", "fr": "FRA", "de": "DEU", "gr": "GRC", "hu": "HUN", "ie": "IRL",
+    "it": "ITA", "lv": "LVA", "lt": "LTU", "lu": "LUX", "mt": "MLT", "nl": "NLD", "pl": "POL",
+    "pt": "PRT", "ro": "ROU", "sk": "SVK", "si": "SVN", "es": "ESP", "se": "SWE",
+}
+# Countries without a feature in Plotly's 1:110m world geometry
+BUNDLED_COUNTRY_CODES = ["mt"]
+
+# Polygons entirely outside this box (overseas territories) are not bundled
+EUROPE_BOUNDS = (-25.0, 27.0, 45.0, 72.0)  # lon min, lat min, lon max, lat max
+COORDINATE_DECIMALS = 3  # about 100 m
+# Country names in the source that differ from the ones used in EU_COUNTRIES
+NAME_ALIASES = {"Czechia": "Czech Republic"}
+
+_shapes = {}
+_lock = threading.Lock()
+
+def _country_code(properties, country_codes):
+    codes = set(country_codes.values())
+    for key in ["ISO_A2_EH", "ISO_A2", "iso_a2"]:
+        code = str(properties.get(key, "")).lower()
+        if code in codes:
+            return code
+    for key in ["NAME", "ADMIN", "name"]:
+        name = properties.get(key)
+        code = country_codes.get(NAME_ALIASES.get(name, name))
+        if code is not None:
+            return code
+    return None
+
+def _polygons(geometry):
+    return [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+
+def _in_bounds(polygon, bounds=EUROPE_BOUNDS):
+    lons = [x for x, _ in polygon[0]]
+    lats = [y for _, y in polygon[0]]
+    return max(lons) >= bounds[0] and min(lons) <= bounds[2] and max(lats) >= bounds[1] and min(lats) <= bounds[3]
+
+def build_country_shapes(source_path, path=FILEPATH_COUNTRY_SHAPES, country_codes=BUNDLED_COUNTRY_CODES):
+    # Regenerates the bundled outlines from a countries GeoJSON (e.g. Natural Earth's
+    # ne_50m_admin_0_countries.geojson), keeping the given countries and their European polygons
+    with open(source_path, encoding="utf-8") as f:
+        source = json.load(f)
+    codes = {name: code for name, code in COUNTRY_CODES.items() if code in country_codes}
+    features = []
+    for feature in source["features"]:
+        code = _country_code(feature["properties"], codes)
+        if code is None or feature["geometry"] is None:
+            continue
+        polygons = [
+            [[[round(x, COORDINATE_DECIMALS), round(y, COORDINATE_DECIMALS)] for x, y in ring] for ring in polygon]
+            for polygon in _polygons(feature["geometry"]) if _in_bounds(polygon)
+        ]
+        features.append({"type": "Feature", "id": code, "geometry": {"type": "MultiPolygon", "coordinates": polygons}})
+    features.sort(key=lambda feature: feature["id"])
+    missing = sorted(set(country_codes) - {feature["id"] for feature in features})
+    if missing:
+        logging.warning(f"No outline in {source_path} for {', '.join(missing)}")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, separators=(",", ":"))
+    logging.info(f"Outlines of {len(features)} countries written to {path}")
+
+def get_country_shapes(path=FILEPATH_COUNTRY_SHAPES):
+    # Loaded once per process; the returned dict is shared, read-only
+    if path not in _shapes:
+        with _lock:
+            if path not in _shapes:
+                with open(path, encoding="utf-8") as f:
+                    _shapes[path] = json.load(f)
+    return _shapes[path]
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    shapes = get_country_shapes()
+    points = sum(len(ring) for feature in shapes["features"] for polygon in feature["geometry"]["coordinates"] for ring in polygon)
+    size = len(json.dumps(shapes, separators=(",", ":")))
+    logging.info(f"{len(shapes['features'])} bundled outlines ({', '.join(feature['id'] for feature in shapes['features'])}), {points} points, {size} bytes")
@@ -0,0 +1,213 @@
+import logging
+import re
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from dataset.geocoding import fold_name
+
+# Gazetteer of EU places with 15000+ inhabitants, extracted from GeoNames (https://www.geonames.org, CC BY 4.0)
+FILEPATH_GAZETTEER = "dataset/gazetteer_eu.csv"
+
+# ISO 3166-1 alpha-2 codes (lowercase, as returned by Nominatim) for the country names used in EU_COUNTRIES
+COUNTRY_CODES = {
+    "Austria": "at", "Belgium": "be", "Bulgaria": "bg", "Croatia": "hr", "Cyprus": "cy",
+    "Czech Republic": "cz", "Denmark": "dk", "Estonia": "ee", "Finland": "fi", "France": "fr",
+    "Germany": "de", "Greece": "gr", "Hungary": "hu", "Ireland": "ie", "Italy": "it",
+    "Latvia": "lv", "Lithuania": "lt", "Luxembourg": "lu", "Malta": "mt", "Netherlands": "nl",
+    "Poland": "pl", "Portugal": "pt", "Romania": "ro", "Slovakia": "sk", "Slovenia": "si",
+    "Spain": "es", "Sweden": "se",
+}
+COUNTRY_NAMES = {code: name for name, code in COUNTRY_CODES.items()}
+
+EARTH_RADIUS_KM = 6371.0088
+GAZETTEER_LEAF_SIZE = 16
+GAZETTEER_MAX_DISTANCE_KM = 50  # farther than this from any known place means "no address"
+GAZETTEER_INFLUENCE_KM_PER_SQRT_POPULATION = 0.01  # 1M inhabitants -> 10 km, 100k -> ~3 km
+# Smaller places don't take a queried name over as their district: next to a town of 20000 the
+# neighbouring source city is a municipality of its own (e.g. Gzira next to Sliema)
+GAZETTEER_DISTRICT_MIN_POPULATION = 100_000
+# Alternate names kept in the gazetteer: Latin-script spellings such as "Cologne" for Köln, the
+# ones an English-language source may use; codes (e.g. "CGN") and other scripts are left out
+LATIN_NAME = re.compile(r"[A-Za-z][A-Za-z .'\-]{3,}")
+
+# Column layout of the GeoNames citiesXXXXX.txt dumps
+GEONAMES_COLUMNS = [
+    "geonameid", "name", "asciiname", "alternatenames", "latitude", "longitude", "feature_class",
+    "feature_code", "country_code", "cc2", "admin1_code", "admin2_code", "admin3_code", "admin4_code",
+    "population", "elevation", "dem", "timezone", "modification_date",
+]
+
+def build_gazetteer(geonames_dump_path, path=FILEPATH_GAZETTEER, country_codes=COUNTRY_CODES.values()):
+    # Regenerates the gazetteer from a GeoNames dump (e.g. cities15000.txt), keeping only
+    # the given countries and dropping city sections (PPLX) so districts don't shadow their city
+    df = pd.read_csv(
+        geonames_dump_path, sep="\t", header=None, names=GEONAMES_COLUMNS, quoting=3,
+        keep_default_na=False, dtype={"geonameid": int, "latitude": float, "longitude": float, "population": int},
+    )
+    df["country_code"] = df["country_code"].str.lower()
+    df = df[df["country_code"].isin(list(country_codes)) & (df["feature_code"] != "PPLX")]
+    df["alternatenames"] = [latin_alternate_names(name, names.split(",")) for name, names in zip(df["name"], df["alternatenames"])]
+    df = df[["geonameid", "name", "latitude", "longitude", "country_code", "population", "alternatenames"]].sort_values("geonameid")
+    df.to_csv(path, index=False)
+    logging.info(f"Gazetteer with {len(df)} places written to {path}")
+    return df
+
+def latin_alternate_names(name, alternate_names):
+    folded = fold_name(name)
+    return "|".join(sorted({alt for alt in alternate_names if LATIN_NAME.fullmatch(alt) and fold_name(alt) != folded}))
+
+def _to_unit_vectors(latitude, longitude):
+    # Points on the unit sphere: the chord distance between them grows monotonically with the
+    # haversine distance, so a plain Euclidean KD-tree returns the great-circle nearest neighbour
+    latitude, longitude = np.radians(latitude), np.radians(longitude)
+    return np.stack([
+        np.cos(latitude) * np.cos(longitude),
+        np.cos(latitude) * np.sin(longitude),
+        np.sin(latitude),
+    ], axis=-1)
+
+class OfflineReverseGeocoder:
+    # Local replacement for Nominatim's reverse(): gazetteer place for a latitude/longitude,
+    # backed by a static KD-tree. Exposes the same reverse() interface as a geopy geolocator.
+    # A point inside the influence radius of a larger place (e.g. a district of a capital)
+    # resolves to that place, mirroring how Nominatim reports the municipality, not the district.
+    # When the query names the city and country, a nearby place known under that name (in any of
+    # its spellings) wins, and only places of that country can win by influence.
+    #
+    # The city returned for a named query is a name the source uses: aggregation keeps a city only
+    # if some source row carries its name (aggregate_prices_df). A place known under the queried
+    # name keeps the queried spelling; a district inside the influence of a large place is named as the
+    # source names that place (source_cities, (city, country) pairs), e.g. a suburb listed next to
+    # "Cologne" becomes "Cologne" rather than the gazetteer's "Köln"; anything else keeps the
+    # queried name, as the gazetteer can't tell a district from a neighbouring town.
+
+    def __init__(self, path=FILEPATH_GAZETTEER, leaf_size=GAZETTEER_LEAF_SIZE, max_distance_km=GAZETTEER_MAX_DISTANCE_KM,
+                 influence_km_per_sqrt_population=GAZETTEER_INFLUENCE_KM_PER_SQRT_POPULATION,
+                 district_min_population=GAZETTEER_DISTRICT_MIN_POPULATION, source_cities=()):
+        self.places = pd.read_csv(path, keep_default_na=False, dtype={"country_code": str})
+        self.points = _to_unit_vectors(self.places["latitude"].to_numpy(), self.places["longitude"].to_numpy())
+        self.names = self.places["name"].tolist()
+        self.folded_names = [
+            {fold_name(name)} | {fold_name(alt) for alt in alternates.split("|") if alt}
+            for name, alternates in zip(self.names, self.places["alternatenames"])
+        ]
+        self.country_codes = self.places["country_code"].tolist()
+        self.population = self.places["population"].tolist()
+        self.influence_km = (influence_km_per_sqrt_population * np.sqrt(self.places["population"].to_numpy())).tolist()
+        self.leaf_size = leaf_size
+        self.max_distance_km = max_distance_km
+        self.district_min_population = district_min_population
+        self.search_km = max([max_distance_km] + self.influence_km)
+        # country code -> folded name -> source spelling
+        self.source_names = {}
+        for city, country in sorted(source_cities):
+            self.source_names.setdefault(COUNTRY_CODES.get(country), {}).setdefault(fold_name(city), city)
+        self._build()
+
+    def _build(self):
+        # Nodes are stored in flat lists; leaves cover self.order[start:end] and have left == -1.
+        # Queries walk the tree in plain Python, which beats per-node NumPy calls at this size.
+        order = np.arange(len(self.points))
+        self.node_start, self.node_end, self.node_dim, self.node_split, self.node_left, self.node_right = [], [], [], [], [], []
+        stack = [(0, len(self.points), self._new_node(0, len(self.points)))]
+        while stack:
+            start, end, node = stack.pop()
+            if end - start <= self.leaf_size:
+                continue
+            indices = order[start:end]
+            dim = int(np.argmax(np.ptp(self.points[indices], axis=0)))
+            mid = (end - start) // 2
+            order[start:end] = indices[np.argpartition(self.points[indices, dim], mid)]
+            self.node_dim[node] = dim
+            self.node_split[node] = float(self.points[order[start + mid], dim])
+            self.node_left[node] = self._new_node(start, start + mid)
+            self.node_right[node] = self._new_node(start + mid, end)
+            stack.append((start, start + mid, self.node_left[node]))
+            stack.append((start + mid, end, self.node_right[node]))
+        self.order = order.tolist()
+        self.xyz = [tuple(point) for point in self.points.tolist()]
+
+    def _new_node(self, start, end):
+        self.node_start.append(start)
+        self.node_end.append(end)
+        self.node_dim.append(0)
+        self.node_split.append(0.0)
+        self.node_left.append(-1)
+        self.node_right.append(-1)
+        return len(self.node_start) - 1
+
+    def within(self, latitude, longitude, radius_km):
+        # Returns [(gazetteer row, distance in km)] for every place closer than radius_km
+        qx, qy, qz = _to_unit_vectors(latitude, longitude).tolist()
+        query = (qx, qy, qz)
+        max_chord2 = (2 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2)) ** 2
+        found = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            left = self.node_left[node]
+            if left == -1:
+                for i in self.order[self.node_start[node]:self.node_end[node]]:
+                    x, y, z = self.xyz[i]
+                    chord2 = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if chord2 <= max_chord2:
+                        found.append((i, chord2))
+                continue
+            diff = query[self.node_dim[node]] - self.node_split[node]
+            if diff >= 0 or diff * diff <= max_chord2:
+                stack.append(self.node_right[node])
+            if diff < 0 or diff * diff <= max_chord2:
+                stack.append(left)
+        return [(i, 2 * EARTH_RADIUS_KM * np.arcsin(min(1.0, chord2 ** 0.5 / 2))) for i, chord2 in found]
+
+    def distance_km(self, index, latitude, longitude):
+        qx, qy, qz = _to_unit_vectors(latitude, longitude).tolist()
+        x, y, z = self.xyz[index]
+        return 2 * EARTH_RADIUS_KM * np.arcsin(min(1.0, ((x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2) ** 0.5 / 2))
+
+    def source_name(self, index, latitude, longitude, city):
+        # Name for a point geocoded from `city`, see the class comment
+        names = self.folded_names[index]
+        if fold_name(city) in names:
+            return city
+        if self.population[index] >= self.district_min_population and self.distance_km(index, latitude, longitude) <= self.influence_km[index]:
+            source_names = self.source_names.get(self.country_codes[index], {})
+            return next((source_names[name] for name in sorted(names) if name in source_names), city)
+        return city
+
+    def lookup(self, latitude, longitude, city=None, country_code=None):
+        # Returns the gazetteer row for a point, or None when nothing is within max_distance_km.
+        # city and country_code, when given, are the names the point was geocoded from.
+        candidates = self.within(latitude, longitude, self.search_km)
+        nearby = [(distance_km, i) for i, distance_km in candidates if distance_km <= self.max_distance_km]
+        in_country = [(distance_km, i) for distance_km, i in nearby if country_code in (None, self.country_codes[i])]
+        if city is not None:
+            folded = fold_name(city)
+            named = [(distance_km, i) for distance_km, i in in_country if folded in self.folded_names[i]]
+            if named:
+                return min(named)[1]
+        covering = [
+            (self.population[i], -distance_km, i) for i, distance_km in candidates
+            if distance_km <= self.influence_km[i] and country_code in (None, self.country_codes[i])
+        ]
+        if covering:
+            return max(covering)[2]
+        if in_country:
+            return min(in_country)[1]
+        return min(nearby)[1] if nearby else None
+
+    def reverse(self, query, language="en", timeout=None, city=None, country=None):
+        latitude, longitude = (float(value) for value in query.split(","))
+        index = self.lookup(latitude, longitude, city, COUNTRY_CODES.get(country))
+        if index is None:
+            return None
+        country_code = self.country_codes[index]
+        name = self.names[index] if city is None else self.source_name(index, latitude, longitude, city)
+        address = {
+            "city": name,
+            "country": COUNTRY_NAMES.get(country_code, country_code),
+            "country_code": country_code,
+        }
+        return SimpleNamespace(raw={"address": address})
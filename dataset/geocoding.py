@@ -0,0 +1,280 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from geopy.exc import GeocoderRateLimited, GeocoderTimedOut, GeocoderUnavailable
+
+from dataset.metrics import increment
+
+FILEPATH_GEOCACHE = "dataset/geocache.sqlite"
+
+GEOCACHE_TTL = 180 * 24 * 3600  # seconds a found location/address is trusted
+GEOCACHE_NEGATIVE_TTL = 30 * 24 * 3600  # seconds a "not found" answer is trusted before asking again
+
+GEOCODING_WORKERS = 4
+GEOCODING_REQUESTS_PER_SECOND = 1.0  # Nominatim usage policy: at most 1 request per second
+GEOCODING_MAX_RETRIES = 3
+GEOCODING_BACKOFF = 2.0  # seconds before the first retry, doubled on each further attempt
+RETRYABLE_ERRORS = (GeocoderTimedOut, GeocoderUnavailable, GeocoderRateLimited)
+
+class GeoCache:
+    # Persistent (city, country) -> geocoding results, stored in SQLite.
+    # Each answer is committed as soon as it is fetched, so an interrupted run resumes where it stopped.
+    # Negative answers (no location / no address) are cached with their own, shorter TTL.
+    # Errors are never cached, so they are retried on the next run.
+
+    def __init__(self, path=FILEPATH_GEOCACHE, ttl=GEOCACHE_TTL, negative_ttl=GEOCACHE_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode (
+                city TEXT NOT NULL,
+                country TEXT NOT NULL,
+                latitude REAL,
+                longitude REAL,
+                forward_at REAL,
+                address TEXT,
+                reverse_at REAL,
+                PRIMARY KEY (city, country)
+            )
+        """)
+        self._conn.commit()
+
+    def _is_fresh(self, fetched_at, found):
+        if fetched_at is None:
+            return False
+        return time.time() - fetched_at < (self.ttl if found else self.negative_ttl)
+
+    def _lookup(self, city, country, columns):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {columns} FROM geocode WHERE city = ? AND country = ?", (city, country)
+            ).fetchone()
+        return row
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        increment("geocache.hits" if hit else "geocache.misses")
+
+    def get_forward(self, city, country):
+        # Returns (hit, (latitude, longitude) or None)
+        row = self._lookup(city, country, "latitude, longitude, forward_at")
+        if row is None or not self._is_fresh(row[2], row[0] is not None):
+            self._record(False)
+            return False, None
+        self._record(True)
+        return True, None if row[0] is None else (row[0], row[1])
+
+    def set_forward(self, city, country, location):
+        latitude, longitude = location if location else (None, None)
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO geocode (city, country, latitude, longitude, forward_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (city, country) DO UPDATE SET
+                    latitude = excluded.latitude,
+                    longitude = excluded.longitude,
+                    forward_at = excluded.forward_at,
+                    address = NULL,
+                    reverse_at = NULL
+            """, (city, country, latitude, longitude, time.time()))
+            self._conn.commit()
+
+    def get_reverse(self, city, country):
+        # Returns (hit, address components dict or None)
+        row = self._lookup(city, country, "address, reverse_at")
+        if row is None or not self._is_fresh(row[1], row[0] is not None):
+            self._record(False)
+            return False, None
+        self._record(True)
+        return True, None if row[0] is None else json.loads(row[0])
+
+    def set_reverse(self, city, country, address):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE geocode SET address = ?, reverse_at = ? WHERE city = ? AND country = ?",
+                (None if address is None else json.dumps(address), time.time(), city, country),
+            )
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+def fold_name(name):
+    # Accent- and case-insensitive form of a place name, e.g. "Poznań" -> "poznan"
+    return "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c)).casefold()
+
+def get_geo_info(suburb, country, geolocator, geo_cache=None, reverse_geocoder=None):
+    # reverse_geocoder, when given, replaces geolocator.reverse (e.g. an OfflineReverseGeocoder);
+    # its answers are local and cheap, so they bypass the cache
+    try:
+        # Geocode using suburb and country
+        if geo_cache is not None:
+            hit, location = geo_cache.get_forward(suburb, country)
+        else:
+            hit, location = False, None
+        if not hit:
+            found = geolocator.geocode(f"{suburb}, {country}", exactly_one=True, timeout=10)
+            location = (found.latitude, found.longitude) if found else None
+            if geo_cache is not None:
+                geo_cache.set_forward(suburb, country, location)
+
+        if location:
+            latitude, longitude = location
+            # Extract city and country code from the address components
+            if reverse_geocoder is not None:
+                location_reversed = reverse_geocoder.reverse(f"{latitude},{longitude}", language="en", timeout=10, city=suburb, country=country)
+                address_components = location_reversed.raw.get("address") if location_reversed else None
+            else:
+                if geo_cache is not None:
+                    hit, address_components = geo_cache.get_reverse(suburb, country)
+                else:
+                    hit, address_components = False, None
+                if not hit:
+                    location_reversed = geolocator.reverse(f"{latitude},{longitude}", language="en", timeout=10)
+                    address_components = location_reversed.raw.get("address") if location_reversed else None
+                    if geo_cache is not None:
+                        geo_cache.set_reverse(suburb, country, address_components)
+            if not address_components:
+                logging.warning(f"Address not found for {suburb}, {country}")
+                return None, None, None, None
+            city = address_components.get("city") or suburb
+            if fold_name(city) == fold_name(suburb):
+                city = suburb
+            country_check = address_components.get("country")
+            country_code = address_components.get("country_code")
+            if country_check.lower() != country.lower():
+                if country_check == "Czechia" and country == "Czech Republic":
+                    pass
+                else:
+                    logging.warning(f"Wrong country {country_check} for {suburb}")
+                    return None, None, None, None
+            logging.info(f"Location found for {suburb}")
+            if city != suburb and city:
+                logging.info(f"Updated city: from {suburb} to {city}")
+            return city, country_code, latitude, longitude
+        else:
+            logging.warning(f"Location not found for {suburb}, {country}")
+            return None, None, None, None
+    except Exception as e:
+        logging.error(f"Error geocoding {suburb}, {country}: {e}")
+        return None, None, None, None
+
+class RateLimiter:
+    # Thread-safe limiter handing out evenly spaced request slots across all workers
+
+    def __init__(self, requests_per_second=GEOCODING_REQUESTS_PER_SECOND):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class RateLimitedGeolocator:
+    # Wraps any geopy-style backend (anything with geocode/reverse) with rate limiting and retries with backoff
+
+    def __init__(self, geolocator, rate_limiter=None, max_retries=GEOCODING_MAX_RETRIES, backoff=GEOCODING_BACKOFF):
+        self.geolocator = geolocator
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self, method, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            with self._lock:
+                self.calls += 1
+            increment(f"geocode.{method}_calls")
+            try:
+                return getattr(self.geolocator, method)(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logging.warning(f"Geocoder {method} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def geocode(self, *args, **kwargs):
+        return self._call("geocode", *args, **kwargs)
+
+    def reverse(self, *args, **kwargs):
+        return self._call("reverse", *args, **kwargs)
+
+class FakeGeolocator:
+    # Offline stand-in for Nominatim with the same geocode/reverse interface.
+    # `locations` maps (city, country) to (latitude, longitude, canonical city, country code);
+    # without it every query resolves to deterministic pseudo-coordinates and echoes its own name back.
+    # `latency` and `failure_rate` emulate network round trips and transient outages.
+
+    def __init__(self, locations=None, latency=0.0, failure_rate=0.0, seed=0):
+        self.locations = locations
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._addresses = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise GeocoderUnavailable("Fake geocoder unavailable")
+
+    def geocode(self, query, exactly_one=True, timeout=None):
+        self._round_trip()
+        suburb, country = query.rsplit(", ", 1)
+        if self.locations is not None:
+            if (suburb, country) not in self.locations:
+                return None
+            latitude, longitude, city, country_code = self.locations[(suburb, country)]
+        else:
+            digest = zlib.crc32(query.encode())
+            latitude = round(35 + (digest % 3000) / 100, 4)
+            longitude = round(-10 + (digest // 3000 % 4000) / 100, 4)
+            city, country_code = suburb, country[:2].lower()
+        with self._lock:
+            self._addresses[f"{latitude},{longitude}"] = {"city": city, "country": country, "country_code": country_code}
+        return SimpleNamespace(latitude=latitude, longitude=longitude)
+
+    def reverse(self, query, language="en", timeout=None):
+        self._round_trip()
+        with self._lock:
+            address = self._addresses.get(query)
+        return SimpleNamespace(raw={"address": address}) if address else None
+
+def geocode_pairs(pairs, geolocator, geo_cache=None, max_workers=GEOCODING_WORKERS,
+                  requests_per_second=GEOCODING_REQUESTS_PER_SECOND, max_retries=GEOCODING_MAX_RETRIES,
+                  backoff=GEOCODING_BACKOFF, reverse_geocoder=None):
+    # Geocoding stage: resolves each distinct (city, country) pair once through a bounded worker pool.
+    # Returns {(city, country): (city_aggr, country_code, latitude, longitude)}
+    pairs = list(dict.fromkeys(pairs))
+    backend = RateLimitedGeolocator(geolocator, RateLimiter(requests_per_second), max_retries, backoff)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda pair: get_geo_info(pair[0], pair[1], backend, geo_cache, reverse_geocoder), pairs))
+    logging.info(f"Geocoded {len(pairs)} distinct locations with {backend.calls} requests in {time.perf_counter() - start:.1f}s")
+    return dict(zip(pairs, results))
@@ -0,0 +1,147 @@
+import logging
+import os
+import time
+
+import pandas as pd
+
+from dataset.preprocessing import (
+    FILEPATH_BUDGET_PROCESSED,
+    FILEPATH_PRICES_PROCESSED,
+    FILEPATH_PRICES_RAW,
+    GEO_COLUMNS,
+    add_geo_info,
+    aggregate_prices_df,
+    calculate_budget_df,
+    read_prices_chunked,
+)
+from dataset.snapshot import (
+    FILEPATH_BUDGET_SNAPSHOT,
+    FILEPATH_PRICES_SNAPSHOT,
+    SNAPSHOT_SCHEMA,
+    read_snapshot,
+    write_snapshot,
+)
+
+# Incremental refresh of the processed datasets. The state snapshot remembers, for every distinct
+# cleaned raw row (by content hash), how many times it occurs and what it geocoded to. A refresh
+# geocodes only rows whose hash is new, recomputes the means of the city_aggr groups whose rows
+# changed, and splices those cities into the processed and budget tables.
+
+FILEPATH_PRICES_ROWS = "dataset/prices_rows.snapshot"
+FILEPATH_CHANGELOG = "dataset/changelog.csv"
+
+STATE_COLUMNS = ["row_hash", "count", "city", "country"] + GEO_COLUMNS
+
+def hash_rows(df: pd.DataFrame):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def _read_state(path):
+    if os.path.exists(os.path.join(path, SNAPSHOT_SCHEMA)):
+        state = read_snapshot(path)
+        # Empty strings stand for failed geocodes, see _write_state
+        state[["city_aggr", "country_code"]] = state[["city_aggr", "country_code"]].replace("", None)
+        return state
+    return None
+
+def _write_state(state, path):
+    write_snapshot(state.fillna({"city_aggr": "", "country_code": ""}), path)
+
+def _splice(df_old, df_patch, cities):
+    # Replace the rows of `cities` in a City-sorted table, keeping the full-rebuild row order
+    df = pd.concat([df_old[~df_old["City"].isin(cities)], df_patch])
+    return df.sort_values("City", kind="stable").reset_index(drop=True)
+
+def _changelog(df_old, df_new, cities):
+    rows = []
+    for city in sorted(cities):
+        old = df_old[df_old["City"] == city].reset_index(drop=True)
+        new = df_new[df_new["City"] == city].reset_index(drop=True)
+        if old.empty and new.empty:
+            continue
+        if old.empty:
+            change = "added"
+        elif new.empty:
+            change = "removed"
+        elif old.equals(new):
+            continue
+        else:
+            change = "updated"
+        country = (new if not new.empty else old)["Country"].iloc[0]
+        rows.append({"City": city, "Country": country, "Change": change})
+    return pd.DataFrame(rows, columns=["City", "Country", "Change"])
+
+def update_prices_incremental(raw_path=FILEPATH_PRICES_RAW, state_path=FILEPATH_PRICES_ROWS,
+                              prices_path=FILEPATH_PRICES_PROCESSED, prices_snapshot_path=FILEPATH_PRICES_SNAPSHOT,
+                              budget_path=FILEPATH_BUDGET_PROCESSED, budget_snapshot_path=FILEPATH_BUDGET_SNAPSHOT,
+                              changelog_path=FILEPATH_CHANGELOG, **geocoding_options):
+    # geocoding_options are passed to add_geo_info (geolocator, geo_cache, offline_reverse, ...)
+    start = time.perf_counter()
+    df = read_prices_chunked(raw_path).reset_index(drop=True)
+    df["row_hash"] = hash_rows(df)
+
+    old_state = state = _read_state(state_path)
+    first_run = state is None
+    if first_run:
+        # Without a state the existing outputs can't be trusted to match, so everything is rebuilt
+        state = pd.DataFrame({column: pd.Series(dtype="uint64" if column == "row_hash" else object) for column in STATE_COLUMNS})
+
+    counts = df["row_hash"].value_counts()
+    old_counts = state.set_index("row_hash")["count"]
+    all_hashes = counts.index.union(old_counts.index)
+    changed = all_hashes[counts.reindex(all_hashes, fill_value=0).to_numpy() != old_counts.reindex(all_hashes, fill_value=0).to_numpy()]
+    inserted = counts.index.difference(old_counts.index)
+    deleted = old_counts.index.difference(counts.index)
+
+    # Geocode only rows never seen before
+    df_inserted = df[df["row_hash"].isin(inserted)].drop_duplicates("row_hash")[["row_hash", "city", "country"]].copy()
+    if not df_inserted.empty:
+        df_inserted = add_geo_info(df_inserted, source_pairs=list(zip(df["city"], df["country"])), **geocoding_options)
+    if first_run:
+        # No previous state: the new one is made of the inserted rows alone
+        state = df_inserted.reindex(columns=STATE_COLUMNS).reset_index(drop=True)
+    elif df_inserted.empty:
+        state = state[~state["row_hash"].isin(deleted)].reset_index(drop=True)
+    else:
+        state = pd.concat([state[~state["row_hash"].isin(deleted)], df_inserted], ignore_index=True)
+    state["count"] = state["row_hash"].map(counts).astype("int64")
+
+    # Deleted rows are attributed to the city they geocoded to last time
+    geo_by_hash = pd.concat([state, old_state]).drop_duplicates("row_hash")
+    affected = set(geo_by_hash.loc[geo_by_hash["row_hash"].isin(changed), "city_aggr"].dropna())
+    logging.info(
+        f"{len(inserted)} new and {len(deleted)} removed distinct rows, "
+        f"{len(changed)} with changed multiplicity, {len(affected)} cities to recompute"
+    )
+
+    # Recompute the affected groups from every current row that belongs to them, in file order
+    df = df.merge(state[["row_hash"] + GEO_COLUMNS], on="row_hash", how="left")
+    df_group_rows = df[df["city_aggr"].isin(affected)].drop(columns=["row_hash"])
+    df_prices_patch = aggregate_prices_df(df_group_rows)
+    df_budget_patch = calculate_budget_df(df_prices_patch)
+
+    if first_run or not os.path.exists(prices_path):
+        df_prices_old = df_prices_patch.iloc[0:0]
+        df_budget_old = df_budget_patch.iloc[0:0]
+    else:
+        df_prices_old = pd.read_csv(prices_path)
+        df_budget_old = pd.read_csv(budget_path)
+    df_prices = _splice(df_prices_old, df_prices_patch, affected)
+    df_budget = _splice(df_budget_old, df_budget_patch, affected)
+
+    df_changelog = _changelog(df_prices_old, df_prices, affected)
+    df_changelog.insert(0, "Timestamp", pd.Timestamp.now(tz="UTC").isoformat(timespec="seconds"))
+
+    df_prices.to_csv(prices_path, index=False)
+    write_snapshot(df_prices, prices_snapshot_path)
+    df_budget.to_csv(budget_path, index=False)
+    write_snapshot(df_budget, budget_snapshot_path)
+    _write_state(state, state_path)
+    df_changelog.to_csv(changelog_path, mode="a", header=not os.path.exists(changelog_path), index=False)
+
+    for change, group in df_changelog.groupby("Change"):
+        logging.info(f"{change}: {', '.join(group['City'])}")
+    logging.info(f"Incremental refresh done in {time.perf_counter() - start:.2f}s")
+    return df_changelog
+
+if __name__ == "__main__":
+    update_prices_incremental()
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide stage timings and counters for the pipeline and the pages. Disabled by default:
+# span() then returns a shared no-op context manager and timed()/increment() return after a
+# single flag check, so the instrumented code pays next to nothing. Once enabled, the numbers can
+# be exported to a JSON file or scraped in Prometheus text format from a local HTTP endpoint.
+
+FILEPATH_METRICS = "dataset/metrics.json"
+PROMETHEUS_PORT = 9464
+METRIC_PREFIX = "cost_of_living"
+
+ENABLED = False
+
+_spans = {}  # name -> [count, total seconds, max seconds]
+_counters = {}
+_lock = threading.Lock()
+_server = None
+
+class _NoopSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+def span(name):
+    return _Span(name) if ENABLED else _NOOP_SPAN
+
+def timed(name):
+    # Decorator form of span() for functions that are a stage as a whole
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def observe(name, seconds):
+    if not ENABLED:
+        return
+    with _lock:
+        stats = _spans.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+def increment(name, value=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+class PhaseTimer:
+    # Times the consecutive phases of a page script without re-indenting it: each phase() call
+    # closes the previous phase. Time is summed per phase name and recorded once per run by done(),
+    # so a phase entered several times (e.g. figure/render per chart) counts as one observation.
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.totals = {}
+        self.current = None
+        self.start = time.perf_counter() if ENABLED else None
+
+    def phase(self, name):
+        if self.start is None:
+            return
+        now = time.perf_counter()
+        if self.current is not None:
+            self.totals[self.current] = self.totals.get(self.current, 0.0) + now - self.start
+        self.current, self.start = name, now
+
+    def done(self):
+        self.phase(None)
+        for name, seconds in self.totals.items():
+            observe(f"{self.prefix}.{name}", seconds)
+        self.totals = {}
+
+def snapshot():
+    with _lock:
+        return {
+            "spans": {
+                name: {"count": count, "seconds_total": total, "seconds_max": longest}
+                for name, (count, total, longest) in sorted(_spans.items())
+            },
+            "counters": dict(sorted(_counters.items())),
+        }
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+def export_file(path=FILEPATH_METRICS):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": time.time(), **snapshot()}, f, indent=1)
+    os.replace(tmp_path, path)
+    logging.info(f"Metrics written to {path}")
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+def prometheus_text():
+    data = snapshot()
+    lines = [
+        f"# HELP {METRIC_PREFIX}_stage_seconds Time spent in each pipeline or page stage.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds summary",
+    ]
+    for name, stats in data["spans"].items():
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{_label(name)}"}} {stats["seconds_total"]}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{_label(name)}"}} {stats["count"]}')
+    lines += [
+        f"# HELP {METRIC_PREFIX}_stage_seconds_max Longest single run of each stage.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds_max gauge",
+    ]
+    for name, stats in data["spans"].items():
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_max{{stage="{_label(name)}"}} {stats["seconds_max"]}')
+    lines += [
+        f"# HELP {METRIC_PREFIX}_events_total Cache hits and misses, geocoding calls and other events.",
+        f"# TYPE {METRIC_PREFIX}_events_total counter",
+    ]
+    for name, value in data["counters"].items():
+        lines.append(f'{METRIC_PREFIX}_events_total{{event="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_prometheus(port=PROMETHEUS_PORT, host="127.0.0.1"):
+    # One endpoint per process, started on first call; later calls are no-ops
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, name="metrics-endpoint", daemon=True).start()
+            logging.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return _server
+
+def enable(prometheus_port=None):
+    global ENABLED
+    ENABLED = True
+    if prometheus_port is not None:
+        serve_prometheus(prometheus_port)
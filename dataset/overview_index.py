@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+# Precomputed structure behind the Overview page. For every metric the rows are kept sorted by
+# value, so a range-slider query is two binary searches returning a slice; the country filter is
+# a lookup-table mask applied to that slice only. Aggregation then runs over the selected rows
+# with bincount, so the cost of an interaction depends on the rows shown, not on the dataset size.
+
+class MetricIndex:
+
+    def __init__(self, values, country_codes, n_countries):
+        self.order = np.argsort(values, kind="stable")
+        self.sorted_values = values[self.order]
+        # Per-country bounds for the slider defaults, NaN for countries without values
+        self.country_min = np.full(n_countries, np.nan)
+        self.country_max = np.full(n_countries, np.nan)
+        valid = ~np.isnan(values)
+        np.fmin.at(self.country_min, country_codes[valid], values[valid])
+        np.fmax.at(self.country_max, country_codes[valid], values[valid])
+
+    def range_rows(self, low, high):
+        # Rows with low <= value <= high (the semantics of Series.between), in ascending value order
+        start = np.searchsorted(self.sorted_values, low, side="left")
+        stop = np.searchsorted(self.sorted_values, high, side="right")
+        return self.order[start:stop]
+
+class OverviewIndex:
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.country_codes, countries = pd.factorize(df["Country"], sort=True)
+        self.countries = countries.tolist()
+        self.city_codes, cities = pd.factorize(df["City"], sort=True)
+        self.cities = np.asarray(cities, dtype=object)
+        self.unique_cities = len(cities) == len(df)
+        # For City rows, "first" in groupby terms: the first row of each city in dataset order
+        self.city_first_row = np.full(len(cities), len(df))
+        np.minimum.at(self.city_first_row, self.city_codes, np.arange(len(df)))
+        self._metrics = {}
+
+    def metric(self, column):
+        if column not in self._metrics:
+            self._metrics[column] = MetricIndex(self.df[column].to_numpy(dtype=float), self.country_codes, len(self.countries))
+        return self._metrics[column]
+
+    def _country_lookup(self, countries):
+        wanted = np.zeros(len(self.countries), dtype=bool)
+        codes = [self.countries.index(country) for country in countries if country in self.countries]
+        wanted[codes] = True
+        return wanted
+
+    def value_bounds(self, column, countries=None):
+        # (min, max) of the metric over the selected countries, or over everything
+        metric = self.metric(column)
+        if not countries:
+            valid = metric.sorted_values[~np.isnan(metric.sorted_values)]
+            return (valid[0], valid[-1]) if len(valid) else (np.nan, np.nan)
+        wanted = self._country_lookup(countries)
+        return np.nanmin(metric.country_min[wanted]), np.nanmax(metric.country_max[wanted])
+
+    def query(self, column, aggregation, countries=None, value_range=None):
+        # Same result as filtering the rows by country and range, grouping by City or Country,
+        # and sorting by the metric in descending order with a 1-based rank index
+        metric = self.metric(column)
+        if value_range is None:
+            rows = metric.order[~np.isnan(metric.sorted_values)]
+        else:
+            rows = metric.range_rows(*value_range)
+        if countries:
+            rows = rows[self._country_lookup(countries)[self.country_codes[rows]]]
+        values = self.df[column].to_numpy(dtype=float)
+
+        if aggregation == "City":
+            if self.unique_cities:
+                # Rows are already sorted by value, so the ranking is the reversed slice
+                groups = self.city_codes[rows[::-1]]
+                means = values[rows[::-1]]
+            else:
+                groups, means = self._group_means(self.city_codes[rows], values[rows], len(self.cities))
+            first_rows = self.city_first_row[groups]
+            df_result = self.df.iloc[first_rows][["City", "Country", "Latitude", "Longitude"]].reset_index(drop=True)
+            df_result[column] = means
+        else:
+            groups, means = self._group_means(self.country_codes[rows], values[rows], len(self.countries))
+            df_result = pd.DataFrame({"Country": np.asarray(self.countries, dtype=object)[groups], column: means})
+
+        df_result.index = pd.RangeIndex(1, len(df_result) + 1)
+        df_result[column] = df_result[column].round(2)
+        return df_result
+
+    @staticmethod
+    def _group_means(codes, values, n_groups):
+        counts = np.bincount(codes, minlength=n_groups)
+        sums = np.bincount(codes, weights=values, minlength=n_groups)
+        groups = np.nonzero(counts)[0]
+        means = sums[groups] / counts[groups]
+        ranking = np.argsort(-means, kind="stable")
+        return groups[ranking], means[ranking]
@@ -1,7 +1,16 @@
 import logging
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from geopy.geocoders import Nominatim
 
+from dataset.gazetteer import OfflineReverseGeocoder
+from dataset.geocoding import GEOCODING_REQUESTS_PER_SECOND, GEOCODING_WORKERS, GeoCache, geocode_pairs
+from dataset.metrics import FILEPATH_METRICS, enable as enable_metrics, export_file as export_metrics, span, timed
+from dataset.snapshot import FILEPATH_BUDGET_SNAPSHOT, FILEPATH_PRICES_SNAPSHOT, write_snapshot
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 pd.options.plotting.backend = "plotly"
 
@@ -135,6 +144,11 @@ NEW_COLUMN_NAMES = {
     "x55": "MortgageInterestRate"
 }
 USD_TO_EUR_RATE = 1.0824
+# Columns read from the raw dump and their types; anything else in the file is never parsed.
+# data_quality may be missing in large dumps, so it is read as float and cast after dropna.
+PRICES_RAW_DTYPES = {"city": "object", "country": "object", **{column: "float64" for column in NEW_COLUMN_NAMES}, "data_quality": "float64"}
+PRICES_RAW_CHUNKSIZE = 100_000
+PROCESS_WORKERS = 1  # processes for the cleaning and aggregation stages of process_df, 1 runs them inline
 BUDGET_DEFAULT = {
     "Salary": "Average", # ("Average", "Custom")
     "Salary Custom": 0,
@@ -230,57 +244,202 @@ def estimate_monthly_budget(row, budget_default=BUDGET_DEFAULT):
         "Montlhy Rent over Income": rent_to_income_ratio
     }
 
-def process_df(df: pd.DataFrame):
-    
-    df = df.dropna()
-    df = df[df["country"].isin(EU_COUNTRIES)]
-    df = df[df["data_quality"] == 1]
-    df = df.rename(columns=NEW_COLUMN_NAMES)
+BUDGET_COLUMNS = [
+    "Monthly Salary",
+    "Other Monthly Income",
+    "Total Monthly Income",
+    "Meals Out",
+    "Groceries",
+    "Clothing",
+    "Transportation",
+    "Household",
+    "Internet",
+    "Leisure",
+    "Sports",
+    "Rent",
+    "Other Monthly Expenses",
+    "Total Monthly Expenses",
+    "Monthly Savings",
+    "Monthly Savings over Income",
+    "Montly Expenses over Income",
+    "Montlhy Rent over Income",
+]
 
-    logging.info(df.describe())
+def estimate_budget_arrays(prices, budget_default=BUDGET_DEFAULT):
+    # Columnar twin of estimate_monthly_budget: `prices` maps column names to arrays and the
+    # budget values may be scalars or arrays, as long as everything broadcasts together.
+    # Every expression keeps the operand order of estimate_monthly_budget so results match exactly.
+    salary = np.where(budget_default["Salary"] == "Custom", budget_default["Salary Custom"], prices["AverageMonthlyNetSalary"])
+    other_income = budget_default["Other Income"]
+    total_income = salary + other_income
+
+    meals_out = budget_default["Meals Out (Cheap)"] * prices["Meal_InexpensiveRestaurant"] + \
+        budget_default["Meals Out (Expensive)"] * prices["Meal_MidRangeRestaurant"] / 2
+    groceries = budget_default["Grocery Shopping"] * (
+        prices["Milk"] + prices["LoafOfBread"] + prices["Rice"] + prices["Eggs"] + prices["LocalCheese"] +
+        prices["ChickenFillets"] + prices["BeefRound"] + prices["Apples"] + prices["Banana"] + prices["Oranges"] +
+        prices["Tomato"] + prices["Potato"] + prices["Onion"] + prices["Lettuce"] + prices["Water_Market"] + prices["Wine_MidRange"]
+    )
+
+    social = budget_default["Social Beers"] * (prices["DomesticBeer_Market"] + prices["ImportedBeer_Market"]) / 2
+
+    transportation = np.where(
+        budget_default["Transport"] == "Public",
+        prices["MonthlyPass_RegularPrice"],
+        np.where(
+            budget_default["Transport"] == "Private",
+            prices["Gasoline"] * 40,
+            prices["TaxiStart"] * 20 + prices["Taxi1km"] * 100,
+        ),
+    )
+
+    household = prices["Utilities_Monthly"]
+    internet = prices["Internet"]
+    leisure = budget_default["Cinemas"] * prices["Cinema_InternationalRelease"] + budget_default["Social Beers"] * (prices["DomesticBeer_Restaurant"] + prices["ImportedBeer_Restaurant"]) / 2
+    fitness = np.asarray(budget_default["Fitness Club"])
+    sports = np.where(fitness.astype(bool), fitness * prices["FitnessClub_Monthly"], 0) + budget_default["Padel Matches"] * prices["TennisCourtRent"]
+
+    clothes = prices["Jeans"] + prices["SummerDress"] + prices["NikeRunningShoes"] + prices["MenLeatherShoes"]
+    clothing = np.where(
+        budget_default["Clothes Shopping"] == "Low",
+        clothes / 12,
+        np.where(budget_default["Clothes Shopping"] == "Medium", clothes / 6, clothes / 3),
+    )
+
+    rent = np.where(
+        budget_default["Rent"] == "Suburbs",
+        prices["Apartment1Bedroom_OutsideCentre"],
+        np.where(budget_default["Rent"] == "Center", prices["Apartment1Bedroom_CityCentre"], budget_default["Rent Custom"]),
+    )
+
+    other_expenses = budget_default["Other Expenses"]
+
+    total_expenses = meals_out + groceries + clothing + social + transportation + household + internet + leisure + sports + rent + other_expenses
+
+    monthly_savings = total_income - total_expenses
+    monthly_savings = np.where(monthly_savings < 0, 0, monthly_savings)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        savings_to_income_ratio = np.where(total_income != 0, (monthly_savings / total_income) * 100, 0)
+        expenses_to_income_ratio = np.where(total_income != 0, (total_expenses / total_income) * 100, 0)
+        rent_to_income_ratio = np.where(total_income != 0, (rent / total_income) * 100, 0)
+
+    values = [
+        salary, other_income, total_income, meals_out, groceries, clothing, transportation,
+        household, internet, leisure, sports, rent, other_expenses, total_expenses, monthly_savings,
+        savings_to_income_ratio, expenses_to_income_ratio, rent_to_income_ratio,
+    ]
+    shape = np.broadcast_shapes(*[np.shape(value) for value in values])
+    return {
+        column: np.broadcast_to(np.asarray(value, dtype=float), shape)
+        for column, value in zip(BUDGET_COLUMNS, values)
+    }
+
+def estimate_monthly_budget_df(df: pd.DataFrame, budget_default=BUDGET_DEFAULT):
+    prices = {column: df[column].to_numpy(dtype=float) for column in NEW_COLUMN_NAMES.values() if column in df.columns}
+    budget_arrays = estimate_budget_arrays(prices, budget_default)
+    return pd.DataFrame(budget_arrays, index=df.index, columns=BUDGET_COLUMNS)
+
+def _profile_arrays(profiles):
+    # Turn a list of budget dicts (or a DataFrame with one profile per row) into column
+    # arrays of shape (n_profiles, 1), so they broadcast against the (n_cities,) price arrays
+    profiles = pd.DataFrame(list(profiles) if not isinstance(profiles, pd.DataFrame) else profiles)
+    for key, value in BUDGET_DEFAULT.items():
+        if key not in profiles.columns:
+            profiles[key] = value
+        else:
+            profiles[key] = profiles[key].where(profiles[key].notna(), value)
+    return {key: profiles[key].to_numpy()[:, np.newaxis] for key in BUDGET_DEFAULT}
+
+def calculate_budget_batch(df: pd.DataFrame, profiles):
+    # Returns a (profile x city x metric) array, metrics ordered as BUDGET_COLUMNS and cities as df rows
+    prices = {column: df[column].to_numpy(dtype=float) for column in NEW_COLUMN_NAMES.values() if column in df.columns}
+    budget_arrays = estimate_budget_arrays(prices, _profile_arrays(profiles))
+    return np.stack([budget_arrays[column] for column in BUDGET_COLUMNS], axis=-1).round(2)
+
+def iter_budget_batches(df: pd.DataFrame, profiles, chunk_size=64):
+    # Streams calculate_budget_batch over chunks of profiles so at most chunk_size x cities x metrics are held at once
+    profiles = pd.DataFrame(list(profiles) if not isinstance(profiles, pd.DataFrame) else profiles)
+    for start in range(0, len(profiles), chunk_size):
+        yield start, calculate_budget_batch(df, profiles.iloc[start:start + chunk_size])
+
+def budget_batch_to_df(df: pd.DataFrame, budget_batch, profile_index=None):
+    # Long format view of a batch result: one row per (profile, city) with the BUDGET_COLUMNS as columns
+    n_profiles, n_cities, _ = budget_batch.shape
+    profile_index = range(n_profiles) if profile_index is None else profile_index
+    index = pd.MultiIndex.from_product([profile_index, df["City"]], names=["Profile", "City"])
+    df_batch = pd.DataFrame(budget_batch.reshape(n_profiles * n_cities, -1), index=index, columns=BUDGET_COLUMNS)
+    df_batch.insert(0, "Country", np.tile(df["Country"].to_numpy(), n_profiles))
+    return df_batch
+
+def clean_prices_df(df: pd.DataFrame):
+    # Row filters and unit conversion only, so it gives the same rows whether applied to the whole dump or chunk by chunk
+    with span("pipeline.filter"):
+        df = df[df["country"].isin(EU_COUNTRIES)]
+        df = df.dropna()
+        df = df[df["data_quality"] == 1]
+        df = df.astype({"data_quality": "int64"})
+    with span("pipeline.rename"):
+        df = df.rename(columns=NEW_COLUMN_NAMES)
 
     # Convert prices from USD to EUR
-    for column in df.columns: 
-        if df[column].dtype == float:
-            df[column] = df[column] / USD_TO_EUR_RATE
-
-    # Add Geo Info
-    geolocator = Nominatim(user_agent="city_coordinates_app")
-
-    def get_geo_info(suburb, country):
-        try:
-            # Geocode using suburb and country
-            location = geolocator.geocode(f"{suburb}, {country}", exactly_one=True, timeout=10)
-
-            if location:
-                # Extract city and country code from the address components
-                location_reversed = geolocator.reverse(f"{location.latitude},{location.longitude}", language="en", timeout=10)
-                address_components = location_reversed.raw.get("address")
-                city = address_components.get("city") or suburb
-                country_check = address_components.get("country")
-                country_code = address_components.get("country_code")
-                if country_check.lower() != country.lower():
-                    if country_check == "Czechia" and country == "Czech Republic":
-                        pass
-                    else:
-                        logging.warning(f"Wrong country {country_check} for {suburb}")
-                        return None, None, None, None
-                logging.info(f"Location found for {suburb}")
-                if city != suburb and city:
-                    logging.info(f"Updated city: from {suburb} to {city}")
-                return city, country_code, location.latitude, location.longitude
-            else:
-                logging.warning(f"Location not found for {suburb}, {country}")
-                return None, None, None, None
-        except Exception as e:
-            logging.error(f"Error geocoding {suburb}, {country}: {e}")
-            return None, None, None, None
-
-    # Apply the function to the DataFrame
-    df[["city_aggr", "country_code", "Latitude", "Longitude"]] = df.apply(
-        lambda row: pd.Series(get_geo_info(row["city"], row["country"])), axis=1
+    with span("pipeline.currency"):
+        for column in df.columns: 
+            if df[column].dtype == float:
+                df[column] = df[column] / USD_TO_EUR_RATE
+
+    return df
+
+def read_prices_chunked(filepath=FILEPATH_PRICES_RAW, chunksize=PRICES_RAW_CHUNKSIZE):
+    # Streaming ingest: only the cleaned EU rows of each chunk are kept, so peak memory is bounded
+    # by the chunk size plus the retained rows, not by the size of the dump
+    start = time.perf_counter()
+    rows_read = 0
+    chunks = []
+    # The types are enforced with astype after parsing: passing dtype= to read_csv makes the C parser ~40% slower.
+    # Without them a chunk whose prices happen to be all integers would come out as int and skip the EUR conversion.
+    with pd.read_csv(filepath, usecols=list(PRICES_RAW_DTYPES), chunksize=chunksize) as reader:
+        for chunk in reader:
+            rows_read += len(chunk)
+            chunks.append(clean_prices_df(chunk.astype(PRICES_RAW_DTYPES)))
+    if not chunks:
+        chunks.append(clean_prices_df(pd.read_csv(filepath, usecols=list(PRICES_RAW_DTYPES), nrows=0).astype(PRICES_RAW_DTYPES)))
+    df = pd.concat(chunks)
+
+    elapsed = time.perf_counter() - start
+    peak_rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logging.info(
+        f"Ingested {rows_read} rows in {elapsed:.2f}s ({rows_read / max(elapsed, 1e-9):.0f} rows/s), "
+        f"kept {len(df)}, peak RSS {peak_rss_mib:.0f} MiB"
     )
+    return df
 
+GEO_COLUMNS = ["city_aggr", "country_code", "Latitude", "Longitude"]
+
+def add_geo_info(df: pd.DataFrame, geolocator=None, geo_cache=None, geocoding_workers=GEOCODING_WORKERS,
+                 geocoding_requests_per_second=GEOCODING_REQUESTS_PER_SECOND, offline_reverse=True, source_pairs=None):
+    # Add Geo Info. source_pairs are all the (city, country) pairs of the source, when df holds
+    # only some of them (incremental runs); the gazetteer names districts after those cities
+    if geolocator is None:
+        geolocator = Nominatim(user_agent="city_coordinates_app")
+    if geo_cache is None:
+        geo_cache = GeoCache()
+    pairs = list(zip(df["city"], df["country"]))
+    # Canonical city names and country codes come from the local gazetteer instead of a second Nominatim call
+    reverse_geocoder = OfflineReverseGeocoder(source_cities=set(pairs if source_pairs is None else source_pairs)) if offline_reverse else None
+    with span("pipeline.geocode"):
+        geo_info = geocode_pairs(
+            pairs, geolocator, geo_cache, geocoding_workers, geocoding_requests_per_second, reverse_geocoder=reverse_geocoder
+        )
+    logging.info(f"Geocoding cache: {geo_cache.hits} hits, {geo_cache.misses} misses")
+    df[GEO_COLUMNS] = pd.DataFrame(
+        [geo_info[pair] for pair in pairs], index=df.index, columns=GEO_COLUMNS
+    ).astype({"Latitude": float, "Longitude": float})
+    return df
+
+@timed("pipeline.aggregate")
+def aggregate_prices_df(df: pd.DataFrame):
+    # Mean prices per city_aggr; every step is local to one city_aggr group
     numeric_cols = df.select_dtypes(include=["number"]).columns.tolist()
     numeric_cols.remove("Latitude")
     numeric_cols.remove("Longitude")
@@ -305,9 +464,77 @@ def process_df(df: pd.DataFrame):
 
     return df
 
+def partition_by_country(df: pd.DataFrame, n_partitions, country_column="country"):
+    # Row positions of up to n_partitions partitions, each holding whole countries, balanced by row
+    # count. Countries sharing a city_aggr (once geocoded) are kept together, so no aggregation
+    # group is ever split across partitions.
+    parent = {country: country for country in df[country_column].unique()}
+    def find(country):
+        while parent[country] != country:
+            country = parent[country]
+        return country
+    if "city_aggr" in df.columns:
+        shared = df.groupby("city_aggr")[country_column].nunique()
+        for countries in df[df["city_aggr"].isin(shared[shared > 1].index)].groupby("city_aggr")[country_column].unique():
+            for country in countries[1:]:
+                parent[find(country)] = find(countries[0])
+    components = df[country_column].map({country: find(country) for country in parent})
+
+    # Largest components first, each to the currently smallest partition
+    sizes = components.value_counts(sort=False).sort_index().sort_values(ascending=False, kind="stable")
+    loads = [0] * min(n_partitions, len(sizes))
+    assignment = {}
+    for component, size in sizes.items():
+        target = loads.index(min(loads))
+        assignment[component] = target
+        loads[target] += size
+    partition = components.map(assignment).to_numpy()
+    return [np.flatnonzero(partition == target) for target in range(len(loads))]
+
+def _map_partitions(function, df: pd.DataFrame, workers, country_column="country"):
+    # Runs `function` on every partition in a process pool; results come back in partition order
+    # whatever order the workers finish in
+    partitions = [df.iloc[rows] for rows in partition_by_country(df, workers, country_column)]
+    if len(partitions) < 2:
+        return [function(df)]
+    with ProcessPoolExecutor(max_workers=len(partitions)) as executor:
+        return list(executor.map(function, partitions))
+
+def process_df(df: pd.DataFrame, geolocator=None, geo_cache=None, geocoding_workers=GEOCODING_WORKERS,
+               geocoding_requests_per_second=GEOCODING_REQUESTS_PER_SECOND, offline_reverse=True, cleaned=False,
+               workers=PROCESS_WORKERS):
+    # cleaned=True skips clean_prices_df for input that already went through it (e.g. read_prices_chunked)
+    # workers > 1 cleans and aggregates country partitions in a process pool. Geocoding stays in this
+    # process, where the rate limit and the cache are shared. The output is identical either way.
+    parallel = workers > 1
+    if not cleaned:
+        if parallel:
+            # Rows outside the EU would be dropped by every partition, so they are not shipped to the workers.
+            # The positional index lets the cleaned partitions be put back in input order.
+            df = df[df["country"].isin(EU_COUNTRIES)].reset_index(drop=True)
+            df = pd.concat(_map_partitions(clean_prices_df, df, workers)).sort_index()
+        else:
+            df = clean_prices_df(df)
+
+    logging.info(df.describe())
+
+    df = add_geo_info(df, geolocator, geo_cache, geocoding_workers, geocoding_requests_per_second, offline_reverse)
+    if not parallel:
+        return aggregate_prices_df(df).reset_index(drop=True)
+
+    start = time.perf_counter()
+    # Spans recorded inside the workers stay there, so the pooled stage is timed here as a whole
+    with span("pipeline.aggregate"):
+        partitions = _map_partitions(aggregate_prices_df, df, workers)
+    # Every City comes from a single partition, so a stable sort gives the sequential row order
+    df = pd.concat(partitions).sort_values("City", kind="stable").reset_index(drop=True)
+    logging.info(f"Aggregated {len(partitions)} partitions with {workers} workers in {time.perf_counter() - start:.2f}s")
+    return df
+
+@timed("pipeline.budget")
 def calculate_budget_df(df: pd.DataFrame, budget_default=BUDGET_DEFAULT):
     
-    budget_columns = df.apply(estimate_monthly_budget, budget_default=budget_default, axis=1, result_type="expand")
+    budget_columns = estimate_monthly_budget_df(df, budget_default)
     df = df[["City", "Country", "Latitude", "Longitude"]]    
     df = pd.concat([df, budget_columns], axis=1)
 
@@ -319,12 +546,23 @@ def calculate_budget_df(df: pd.DataFrame, budget_default=BUDGET_DEFAULT):
 
 if __name__ == "__main__":
     FULL = False
+    CHUNKED = True
+    METRICS = False
+    if METRICS:
+        enable_metrics()
     if FULL:
-        df = pd.read_csv(FILEPATH_PRICES_RAW)
-        df = process_df(df)
+        if CHUNKED:
+            df = process_df(read_prices_chunked(FILEPATH_PRICES_RAW), cleaned=True)
+        else:
+            df = pd.read_csv(FILEPATH_PRICES_RAW)
+            df = process_df(df)
         df.to_csv(FILEPATH_PRICES_PROCESSED, index=False)
     else:
         df = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+    write_snapshot(df, FILEPATH_PRICES_SNAPSHOT)
     df = calculate_budget_df(df)
     df.to_csv(FILEPATH_BUDGET_PROCESSED, index=False)
+    write_snapshot(df, FILEPATH_BUDGET_SNAPSHOT)
+    if METRICS:
+        export_metrics(FILEPATH_METRICS)
     logging.info("Done")
\ No newline at end of file
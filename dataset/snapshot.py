@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+# A snapshot is a directory holding one Fortran-ordered .npy matrix per numeric dtype (so every
+# column is a contiguous slice), the string columns as int32 codes, and a schema.json sidecar with
+# the column order, dtypes and string categories. Numeric blocks are memory-mapped on load, so
+# every process reading the same snapshot shares the OS page cache instead of parsing its own copy.
+#
+# Block files are named after their content and the schema lists the files it belongs with, so a
+# rewrite adds new block files, then swaps the schema in atomically: a reader opens the blocks
+# named by the schema it read, never a mix of two writes. Block files of the previous schema are
+# kept until the next write, for readers that read that schema just before the swap.
+
+FILEPATH_PRICES_SNAPSHOT = "dataset/prices_processed.snapshot"
+FILEPATH_BUDGET_SNAPSHOT = "dataset/budget_processed.snapshot"
+
+SNAPSHOT_SCHEMA = "schema.json"
+SNAPSHOT_CODES = "codes"
+
+def _block_file(block, values):
+    digest = hashlib.sha1(str((values.dtype.str, values.shape)).encode())
+    digest.update(np.ascontiguousarray(values.T).data)
+    return f"{block}.{digest.hexdigest()[:16]}.npy"
+
+def _block_files(schema):
+    # Block -> file name; snapshots written before the names were versioned use {block}.npy
+    files = schema.get("files", {})
+    return {block: files.get(block, f"{block}.npy") for block in {column["block"] for column in schema["columns"]}}
+
+def _replace_file(path, write):
+    # Write to a temporary file and swap it in, so processes mapping the old file keep a consistent view
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def write_snapshot(df: pd.DataFrame, path):
+    os.makedirs(path, exist_ok=True)
+    df = df.reset_index(drop=True)
+    columns, blocks = [], {}
+    for name in df.columns:
+        if pd.api.types.is_numeric_dtype(df[name]):
+            block = str(df[name].dtype)
+        else:
+            block = SNAPSHOT_CODES
+        blocks.setdefault(block, []).append(name)
+        columns.append({"name": name, "block": block, "position": len(blocks[block]) - 1})
+
+    categories, files = {}, {}
+    for block, names in blocks.items():
+        if block == SNAPSHOT_CODES:
+            codes = np.empty((len(df), len(names)), dtype=np.int32, order="F")
+            for i, name in enumerate(names):
+                codes[:, i], uniques = pd.factorize(df[name].astype(str), sort=True)
+                categories[name] = uniques.tolist()
+            values = codes
+        else:
+            values = np.asfortranarray(df[names].to_numpy(dtype=block))
+        files[block] = _block_file(block, values)
+        # A block with the same content is already in place (and maybe mapped by readers)
+        if not os.path.exists(os.path.join(path, files[block])):
+            _replace_file(os.path.join(path, files[block]), lambda f: np.save(f, values))
+
+    for column in columns:
+        if column["block"] == SNAPSHOT_CODES:
+            column["categories"] = categories[column["name"]]
+    schema_path = os.path.join(path, SNAPSHOT_SCHEMA)
+    previous_files = {}
+    if os.path.exists(schema_path):
+        with open(schema_path, encoding="utf-8") as f:
+            previous_files = _block_files(json.load(f))
+    # The schema goes last, so readers never see a schema pointing at blocks that aren't written yet
+    schema = json.dumps({"rows": len(df), "columns": columns, "files": files}, ensure_ascii=False, indent=1).encode("utf-8")
+    _replace_file(schema_path, lambda f: f.write(schema))
+    # Blocks of neither this write nor the previous one are no longer read by anyone
+    kept = set(files.values()) | set(previous_files.values())
+    for name in os.listdir(path):
+        if name.endswith(".npy") and name not in kept:
+            os.remove(os.path.join(path, name))
+    logging.info(f"Snapshot with {len(df)} rows written to {path}")
+
+def read_snapshot(path):
+    with open(os.path.join(path, SNAPSHOT_SCHEMA), encoding="utf-8") as f:
+        schema = json.load(f)
+    blocks = {block: np.load(os.path.join(path, name), mmap_mode="r") for block, name in _block_files(schema).items()}
+
+    # Numeric blocks become pandas blocks as-is (the Fortran matrix transposes to a C-contiguous
+    # block without copying); only the string columns are materialised, and inserted afterwards
+    df = None
+    for block, values in blocks.items():
+        if block == SNAPSHOT_CODES:
+            continue
+        names = sorted((c for c in schema["columns"] if c["block"] == block), key=lambda c: c["position"])
+        df_block = pd.DataFrame(values, columns=[c["name"] for c in names], copy=False)
+        df = df_block if df is None else df.join(df_block)
+    if df is None:
+        df = pd.DataFrame(index=pd.RangeIndex(schema["rows"]))
+
+    for i, column in enumerate(schema["columns"]):
+        if column["block"] == SNAPSHOT_CODES:
+            categories = np.array(column["categories"], dtype=object)
+            df.insert(i, column["name"], categories[blocks[SNAPSHOT_CODES][:, column["position"]]])
+    names = [column["name"] for column in schema["columns"]]
+    if df.columns.tolist() != names:
+        df = df[names]
+    return df
+
+def load_dataset(snapshot_path, csv_path):
+    # Pages read the snapshot; the CSV export is only a fallback when no snapshot has been built
+    if os.path.exists(os.path.join(snapshot_path, SNAPSHOT_SCHEMA)):
+        return read_snapshot(snapshot_path)
+    logging.warning(f"No snapshot at {snapshot_path}, reading {csv_path}")
+    return pd.read_csv(csv_path)
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from dataset.cache import LRUCache, canonical_hash
+from dataset.compact import compact_df, price_matrix
+from dataset.metrics import increment
+from dataset.overview_index import OverviewIndex
+from dataset.preprocessing import BUDGET_DEFAULT, FILEPATH_BUDGET_PROCESSED, FILEPATH_PRICES_PROCESSED, calculate_budget_df
+from dataset.snapshot import FILEPATH_BUDGET_SNAPSHOT, FILEPATH_PRICES_SNAPSHOT, SNAPSHOT_SCHEMA, load_dataset
+
+# Process-wide dataset service. Streamlit reruns page scripts but keeps imported modules, so the
+# frames held here are loaded once per server process and shared by every session. They are
+# read-only (numeric columns are memory-mapped): pages must derive new frames, never mutate them.
+# Each access re-stats the backing files and reloads when their size or mtime changed.
+
+DATASETS = {
+    "prices": (FILEPATH_PRICES_SNAPSHOT, FILEPATH_PRICES_PROCESSED),
+    "budget": (FILEPATH_BUDGET_SNAPSHOT, FILEPATH_BUDGET_PROCESSED),
+}
+
+# matrix is the PriceMatrix behind the float32 columns of a compact frame (positional access for
+# vectorized code, without another copy of the values), None when COMPACT is off
+Dataset = namedtuple("Dataset", ["df", "version", "matrix"])
+
+# Opt-in float32/categorical frames, see dataset/compact.py for the rounding tolerance
+COMPACT = False
+
+BUDGET_CACHE_MAX_ENTRIES = 256
+BUDGET_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+_loaded = {}
+_lock = threading.Lock()
+
+# Budget results shared by all sessions, keyed on (dataset, dataset version, budget hash)
+budget_cache = LRUCache(BUDGET_CACHE_MAX_ENTRIES, BUDGET_CACHE_MAX_BYTES, name="budget")
+# Overview indexes, one per dataset version; older versions age out
+overview_index_cache = LRUCache(max_entries=2, name="overview_index")
+
+def _backing_files(snapshot_path, csv_path):
+    # A snapshot write ends by swapping in a schema that names its block files (dataset/snapshot.py),
+    # so the schema alone tells a new snapshot; the blocks and in-flight .tmp files are left alone,
+    # as they may be replaced or removed while this runs
+    schema_path = os.path.join(snapshot_path, SNAPSHOT_SCHEMA)
+    if os.path.exists(schema_path):
+        return [schema_path]
+    return [csv_path]
+
+def _fingerprint(files):
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+def get_dataset(name):
+    snapshot_path, csv_path = DATASETS[name]
+    version = _fingerprint(_backing_files(snapshot_path, csv_path))
+    dataset = _loaded.get(name)
+    if dataset is not None and dataset.version == version:
+        return dataset
+    with _lock:
+        dataset = _loaded.get(name)
+        if dataset is None or dataset.version != version:
+            if dataset is not None:
+                logging.info(f"Dataset {name} changed on disk, reloading (version {dataset.version} -> {version})")
+            df = load_dataset(snapshot_path, csv_path)
+            increment(f"dataset.{name}.loads")
+            matrix = price_matrix(df) if COMPACT else None
+            dataset = Dataset(compact_df(df, matrix) if COMPACT else df, version, matrix)
+            _loaded[name] = dataset
+    return dataset
+
+def get_dataset_version(name):
+    return get_dataset(name).version
+
+def get_budget_df(budget, dataset_name="prices"):
+    dataset = get_dataset(dataset_name)
+    budget = {**BUDGET_DEFAULT, **budget}
+    key = (dataset_name, dataset.version, canonical_hash(budget))
+    if COMPACT:
+        return budget_cache.get_or_compute(key, lambda: compact_df(calculate_budget_df(dataset.df, budget)))
+    return budget_cache.get_or_compute(key, lambda: calculate_budget_df(dataset.df, budget))
+
+def get_overview_index(dataset_name="budget"):
+    dataset = get_dataset(dataset_name)
+    return overview_index_cache.get_or_compute((dataset_name, dataset.version), lambda: OverviewIndex(dataset.df))
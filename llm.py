@@ -1,77 +1,387 @@
-from langchain.llms import HuggingFaceTextGenInference
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
-
-# Load the local LLM model and tokenizer
-model_name = "your-local-llm-model-name"  # Replace with your model name
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForCausalLM.from_pretrained(model_name)
-
-# Initialize HuggingFaceTextGenInference with the local model
-llm = HuggingFaceTextGenInference(model=model, tokenizer=tokenizer)
-
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+import logging
+import threading
+import time
+import uuid
+
 import streamlit as st
 
-# Initialize a list to keep track of previously generated fun facts
-previous_fun_facts = []
+from dataset.metrics import increment, observe
+from llm_cache import ResponseCache, response_key
+from llm_dedup import FunFactIndex
+from llm_digest import build_digest
+from llm_prefix import PrefixCache, match_prefix
+from llm_queue import InferenceQueue, InferenceRequest, QueueFull, TransformersBackend
 
-def generate_summary(data, page_context):
-    preprompt = """
+# Local LLM behind the sidebar summary and fun facts. The model is a process-wide resource: it is
+# loaded once, in a background thread started by the first page that needs it, and shared by every
+# session. Pages never wait for it; until it is ready the sidebar only shows the loading state.
+# torch/transformers are imported by the loader, so importing this module is cheap.
+
+LLM_ENABLED = False
+MODEL_NAME = "your-local-llm-model-name"  # Replace with your model name
+MAX_NEW_TOKENS = 256
+
+_llm = None
+_prefix_cache = None
+_load_error = None
+_loader = None
+_response_cache = None
+_inference_queue = None
+_lock = threading.Lock()
+
+def _load_llm():
+    global _llm, _prefix_cache, _load_error
+    try:
+        from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+
+        # Load the local LLM model and tokenizer
+        logging.info(f"Loading LLM {MODEL_NAME}")
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
+        # Batched generation pads the shorter prompts, on the left so that every prompt ends right
+        # before the first generated token (a decoder-only model continues after the last position)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = "left"
+        # The static instructions are encoded once here and reused by every streamed generation
+        prefix_cache = PrefixCache(model, tokenizer, PROMPT_PREFIXES)
+        prefix_cache.warm_up()
+        _prefix_cache = prefix_cache
+        _llm = pipeline("text-generation", model=model, tokenizer=tokenizer, max_new_tokens=MAX_NEW_TOKENS, return_full_text=False)
+        logging.info(f"LLM {MODEL_NAME} ready")
+    except Exception as e:
+        logging.exception(f"LLM {MODEL_NAME} failed to load")
+        _load_error = e
+
+def warm_up():
+    # Starts the background load once per process; later calls return immediately
+    global _loader
+    with _lock:
+        if _loader is None:
+            _loader = threading.Thread(target=_load_llm, name="llm-loader", daemon=True)
+            _loader.start()
+    return _loader
+
+def llm_status():
+    if _llm is not None:
+        return "ready"
+    if _load_error is not None:
+        return "failed"
+    return "loading" if _loader is not None else "idle"
+
+def is_ready():
+    return _llm is not None
+
+def get_llm(timeout=None):
+    # Blocks until the model is loaded (or `timeout` seconds passed); raises if loading failed
+    warm_up().join(timeout)
+    if _load_error is not None:
+        raise RuntimeError(f"LLM {MODEL_NAME} failed to load") from _load_error
+    if _llm is None:
+        raise TimeoutError(f"LLM {MODEL_NAME} still loading")
+    return _llm
+
+def get_response_cache():
+    global _response_cache
+    with _lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+    return _response_cache
+
+# Each template opens with a static prefix, whose key/value cache is computed once (llm_prefix.py);
+# everything that varies per request comes after it
+SUMMARY_PREFIX = """
     You are an expert data analyst. Provide a concise and insightful summary of the following data.
-    Consider the context of the analysis, which is focused on {page_context}.
     Ensure the summary is informative and highlights key insights relevant to cost of living and economic indicators.
     """
-    prompt_template = PromptTemplate(
-        input_variables=["data", "page_context"],
-        template=preprompt + "Data:\n{data}\nSummary:"
-    )
-    chain = LLMChain(llm=llm, prompt=prompt_template)
-    return chain.run({"data": data, "page_context": page_context})
+SUMMARY_TEMPLATE = SUMMARY_PREFIX + """Consider the context of the analysis, which is focused on {page_context}.
+    """ + "Data:\n{data}\nSummary:"
 
-def generate_fun_fact(data, page_context):
-    global previous_fun_facts
-
-    preprompt = """
+FUN_FACT_PREFIX = """
     You are a creative assistant. Generate a fun and engaging fact based on the following data.
-    Consider the context of the analysis, which is focused on {page_context}.
     Ensure the fun fact is unique and not previously mentioned.
-    Previous fun facts: {previous_fun_facts}
     """
-    prompt_template = PromptTemplate(
-        input_variables=["data", "page_context", "previous_fun_facts"],
-        template=preprompt + "Data:\n{data}\nFun fact:"
-    )
-    chain = LLMChain(llm=llm, prompt=prompt_template)
-    fun_fact = chain.run({"data": data, "page_context": page_context, "previous_fun_facts": ", ".join(previous_fun_facts)})
+FUN_FACT_TEMPLATE = FUN_FACT_PREFIX + """Consider the context of the analysis, which is focused on {page_context}.
+    Do not repeat this earlier fact: {avoid}
+    """ + "Data:\n{data}\nFun fact:"
+
+PROMPT_PREFIXES = [SUMMARY_PREFIX, FUN_FACT_PREFIX]
+
+FUN_FACT_MAX_ATTEMPTS = 3  # generations per request before a near-duplicate fact is shown anyway
+FUN_FACT_AVOID_CHARS = 300
+
+STREAM_POLL_SECONDS = 0.05
+
+def get_inference_queue():
+    # Every session's prompts go through one worker, see llm_queue.py
+    global _inference_queue
+    with _lock:
+        if _inference_queue is None:
+            _inference_queue = InferenceQueue(TransformersBackend(_stream_pipeline, _stream_batch_pipeline))
+    return _inference_queue
+
+def _stream_via_queue(prompt, on_text, cancelled, session_id=None):
+    # Prompts are batched with others of the same template only, so a batch shares one cached prefix
+    request = InferenceRequest(prompt, session_id, MAX_NEW_TOKENS, on_text, cancelled, batch_key=match_prefix(prompt, PROMPT_PREFIXES))
+    return get_inference_queue().submit(request).wait()
 
-    # Add the new fun fact to the list of previous fun facts
-    previous_fun_facts.append(fun_fact)
+def _generate_cached(template, inputs, cache_inputs=None, bypass_cache=False, session_id=None):
+    # Generated texts are cached on (template, model, cache_inputs); cache_inputs defaults to all
+    # inputs and leaves out those that shouldn't split the cache (e.g. the fun fact history)
+    def generate():
+        return _stream_via_queue(template.format(**inputs), None, threading.Event(), session_id)
 
+    key = response_key(template, MODEL_NAME, inputs if cache_inputs is None else cache_inputs)
+    return get_response_cache().get_or_generate(key, generate, bypass=bypass_cache)
+
+def _fun_fact_inputs(data, page_context, avoid=None):
+    # Only the one fact the last attempt repeated goes into the prompt, so its size doesn't grow
+    # with the history; near-duplicates are caught locally by FunFactIndex
+    avoid = avoid[:FUN_FACT_AVOID_CHARS] if avoid else "None"
+    return {"data": data, "page_context": page_context, "avoid": avoid}
+
+def generate_summary(data, page_context):
+    return _generate_cached(SUMMARY_TEMPLATE, {"data": data, "page_context": page_context})
+
+def generate_fun_fact(data, page_context, bypass_cache=False, history=None, session_id=None):
+    # history is the caller's FunFactIndex of facts already shown; a fact too close to one of them
+    # is regenerated, at most FUN_FACT_MAX_ATTEMPTS times in all
+    history = history if history is not None else FunFactIndex()
+    avoid = None
+    for attempt in range(FUN_FACT_MAX_ATTEMPTS):
+        fun_fact = _generate_cached(
+            FUN_FACT_TEMPLATE,
+            _fun_fact_inputs(data, page_context, avoid),
+            cache_inputs={"data": data, "page_context": page_context},
+            bypass_cache=bypass_cache or attempt > 0,
+            session_id=session_id,
+        )
+        avoid = None if not bypass_cache and attempt == 0 and fun_fact in history else history.near_duplicate(fun_fact)
+        if avoid is None:
+            break
+        increment("llm.fun_fact_duplicates")
+    history.add(fun_fact)
     return fun_fact
 
-# Example usage in Streamlit app
-if page == "Overview":
-    page_context = "an overview of average monthly savings across Europe"
-    # Generate summary and fun fact based on the filtered data
-    filtered_data = merged_eu_data_aggregated[merged_eu_data_aggregated['country'].isin([household_type])]
-    st.sidebar.write("### Summary")
-    
-
-    st.sidebar.write("### Fun Fact")
-    if st.sidebar.button("Generate New Fun Fact"):
-        st.sidebar.write(generate_fun_fact(filtered_data.to_string(), page_context))
-
-elif page == "Choose Your Country":
-    page_context = "a comparison of monthly budgets between selected countries"
-    # Generate summary and fun fact based on the filtered data
-    filtered_data = merged_eu_data_aggregated[merged_eu_data_aggregated['country'] == country]
-    st.sidebar.write("### Summary")
-    st.sidebar.write(generate_summary(filtered_data.to_string(), page_context))
-
-    st.sidebar.write("### Fun Fact")
-    if st.sidebar.button("Generate New Fun Fact"):
-        st.sidebar.write(generate_fun_fact(filtered_data.to_string(), page_context))
+def _stream_pipeline(prompt, on_text, cancelled, max_new_tokens=MAX_NEW_TOKENS):
+    # Runs the local model with a streamer that hands each decoded piece to on_text, and a
+    # stopping criterion that ends generation at the next token once `cancelled` is set. The
+    # prompt's static prefix comes from the prefix cache, so only the rest is prefilled.
+    from transformers import StoppingCriteria, StoppingCriteriaList, TextStreamer
+
+    class CallbackStreamer(TextStreamer):
+        def on_finalized_text(self, text, stream_end=False):
+            if text:
+                on_text(text)
+
+    class StopWhenCancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return cancelled.is_set()
+
+    generator = get_llm()
+    _prefix_cache.generate(
+        prompt,
+        streamer=CallbackStreamer(generator.tokenizer, skip_prompt=True, skip_special_tokens=True),
+        stopping_criteria=StoppingCriteriaList([StopWhenCancelled()]),
+        max_new_tokens=max_new_tokens,
+    )
+
+def _stream_batch_pipeline(prompts, on_texts, cancelled, max_new_tokens=MAX_NEW_TOKENS):
+    # Batched counterpart of _stream_pipeline: one generate() call for prompts of several sessions.
+    # TextStreamer only takes batch size 1, so each row's new tokens are decoded here and the new
+    # text handed to its on_text; a cancelled row stops (and is padded) while the others go on.
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+    from transformers.generation.streamers import BaseStreamer
+
+    generator = get_llm()
+    tokenizer = generator.tokenizer
+
+    class BatchStreamer(BaseStreamer):
+        def __init__(self):
+            self.prompt_skipped = False
+            self.tokens = [[] for _ in prompts]
+            self.sent = [0] * len(prompts)
+
+        def put(self, value):
+            # The first call carries the prompts, every later one the next token of each row
+            if not self.prompt_skipped:
+                self.prompt_skipped = True
+                return
+            for i, token in enumerate(value.reshape(-1).tolist()):
+                if cancelled[i].is_set():
+                    continue
+                self.tokens[i].append(token)
+                text = tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+                # An incomplete multi-byte character waits for the next token
+                if len(text) > self.sent[i] and not text.endswith("�"):
+                    on_texts[i](text[self.sent[i]:])
+                    self.sent[i] = len(text)
+
+        def end(self):
+            pass
+
+    class StopCancelledRows(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.tensor([event.is_set() for event in cancelled], dtype=torch.bool, device=input_ids.device)
+
+    _prefix_cache.generate_batch(
+        prompts,
+        streamer=BatchStreamer(),
+        stopping_criteria=StoppingCriteriaList([StopCancelledRows()]),
+        max_new_tokens=max_new_tokens,
+    )
+
+
+class Generation:
+    # One streamed completion running in a background thread. The page polls it for the text so
+    # far; a finished, uncancelled completion is written to the response cache.
+
+    def __init__(self, key, prompt, session_id=None, stream=_stream_via_queue):
+        self.key = key
+        self.prompt = prompt
+        self.session_id = session_id
+        self.text = ""
+        self.error = None
+        self.first_token_seconds = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self._stream = stream
+        self._pieces = []
+        self._pieces_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="llm-generation", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        if not self.done.is_set():
+            self.cancelled.set()
+            increment("llm.cancelled")
+
+    def _on_text(self, text):
+        if self.first_token_seconds is None:
+            self.first_token_seconds = time.perf_counter() - self._start
+            observe("llm.time_to_first_token", self.first_token_seconds)
+        with self._pieces_lock:
+            self._pieces.append(text)
+
+    def _run(self):
+        self._start = time.perf_counter()
+        try:
+            self._stream(self.prompt, self._on_text, self.cancelled, self.session_id)
+            if not self.cancelled.is_set():
+                observe("llm.generation", time.perf_counter() - self._start)
+                get_response_cache().set(self.key, self.poll())
+        except QueueFull as e:
+            self.error = e
+        except Exception as e:
+            logging.exception("LLM generation failed")
+            self.error = e
+        finally:
+            self.done.set()
+
+    def poll(self):
+        with self._pieces_lock:
+            self.text += "".join(self._pieces)
+            self._pieces = []
+        return self.text
+
+def _stream_into(placeholders, generations):
+    # Polls the running generations and redraws their placeholders until all of them finished.
+    # A rerun interrupts this loop at the next element update; the generations keep running and
+    # the next run picks them up again if the selection didn't change.
+    pending = dict(generations)
+    while pending:
+        for name, generation in list(pending.items()):
+            finished = generation.done.is_set()
+            text = generation.poll()
+            if finished:
+                del pending[name]
+                if isinstance(generation.error, QueueFull):
+                    placeholders[name].caption(":material/hourglass_top: Assistant busy, try again in a moment")
+                    continue
+                if generation.error is not None:
+                    placeholders[name].caption(":material/error: Generation failed")
+                    continue
+            placeholders[name].markdown(text if finished else text + "▌")
+        if pending:
+            time.sleep(STREAM_POLL_SECONDS)
+
+def render_sidebar(df, page_context):
+    # Summary and fun fact for the data shown on a page; never blocks the page on the model load.
+    # Both are generated concurrently and stream into the sidebar; texts already in the response
+    # cache are shown at once.
+    if not LLM_ENABLED:
+        return
+    # A bounded digest rather than df.to_string(), so prompt length doesn't grow with the selection
+    data = build_digest(df)
+    warm_up()
+    status = llm_status()
+    with st.sidebar:
+        if status == "failed":
+            st.caption(":material/error: Assistant unavailable")
+            return
+        if status != "ready":
+            st.caption(":material/hourglass_top: Assistant loading, summaries will appear on the next interaction")
+            return
+
+        st.write("### Summary")
+        summary_placeholder = st.empty()
+        st.write("### Fun Fact")
+        fun_fact_placeholder = st.empty()
+        # A new fact is what the button asks for, so the cached one is skipped
+        new_fun_fact = st.button("Generate New Fun Fact")
+
+    # Fun facts already shown to this session, kept bounded in FunFactIndex
+    history = st.session_state.setdefault("llm_fun_facts", FunFactIndex())
+    base_inputs = {"data": data, "page_context": page_context}
+    fun_fact_key = response_key(FUN_FACT_TEMPLATE, MODEL_NAME, base_inputs)
+    requests = {
+        "summary": (SUMMARY_TEMPLATE.format(**base_inputs), response_key(SUMMARY_TEMPLATE, MODEL_NAME, base_inputs), False),
+        "fun_fact": (FUN_FACT_TEMPLATE.format(**_fun_fact_inputs(data, page_context)), fun_fact_key, new_fun_fact),
+    }
+    placeholders = {"summary": summary_placeholder, "fun_fact": fun_fact_placeholder}
+
+    # In-flight generations of this session; those for another selection are cancelled
+    session_id = st.session_state.setdefault("llm_session_id", uuid.uuid4().hex)
+    in_flight = st.session_state.setdefault("llm_generations", {})
+    running = {}
+    for name, (prompt, key, bypass) in requests.items():
+        generation = in_flight.get(name)
+        if generation is not None and (generation.key != key or bypass):
+            generation.cancel()
+            generation = None
+        if generation is None or generation.done.is_set():
+            cached = None if bypass else get_response_cache().get(key)
+            # A cached fact this session already saw is shown again; one close to another fact it
+            # saw is generated anew
+            if cached is not None and name == "fun_fact" and cached not in history and history.near_duplicate(cached) is not None:
+                increment("llm.fun_fact_duplicates")
+                cached = None
+            if cached is not None:
+                if name == "fun_fact":
+                    history.add(cached)
+                placeholders[name].markdown(cached)
+                in_flight.pop(name, None)
+                continue
+            generation = Generation(key, prompt, session_id).start()
+            in_flight[name] = generation
+        running[name] = generation
+
+    _stream_into(placeholders, running)
+
+    # A fresh fact too close to one already shown is regenerated with that fact in the prompt
+    fun_fact = running.get("fun_fact")
+    for attempt in range(1, FUN_FACT_MAX_ATTEMPTS + 1):
+        if fun_fact is None or fun_fact.error is not None or fun_fact.cancelled.is_set():
+            break
+        avoid = history.near_duplicate(fun_fact.text)
+        if avoid is None or attempt == FUN_FACT_MAX_ATTEMPTS:
+            history.add(fun_fact.text)
+            break
+        increment("llm.fun_fact_duplicates")
+        prompt = FUN_FACT_TEMPLATE.format(**_fun_fact_inputs(data, page_context, avoid))
+        fun_fact = in_flight["fun_fact"] = Generation(fun_fact_key, prompt, session_id).start()
+        _stream_into({"fun_fact": fun_fact_placeholder}, {"fun_fact": fun_fact})
@@ -0,0 +1,96 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from dataset.cache import canonical_hash
+from dataset.metrics import increment
+
+FILEPATH_LLM_CACHE = "dataset/llm_cache.sqlite"
+
+LLM_CACHE_TTL = 7 * 24 * 3600  # seconds a generated text is reused
+LLM_CACHE_MAX_BYTES = 64 * 1024 ** 2  # least recently used responses are evicted above this size
+
+def data_digest(data):
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+def response_key(template, model, inputs):
+    # The data table can be large, so it enters the key through its digest
+    inputs = {name: data_digest(value) if name == "data" else value for name, value in inputs.items()}
+    return canonical_hash({"template": template, "model": model, "inputs": inputs})
+
+class ResponseCache:
+    # Persistent prompt -> generated text, stored in SQLite and shared by every session and server
+    # process. Entries expire after `ttl` seconds; above `max_bytes` the least recently read go first.
+
+    def __init__(self, path=FILEPATH_LLM_CACHE, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS response_accessed_at ON response (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM response WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                self._conn.execute("UPDATE response SET accessed_at = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                increment("llm_cache.hits")
+                return row[0]
+            self.misses += 1
+            increment("llm_cache.misses")
+            return None
+
+    def set(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO response (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    response = excluded.response,
+                    size = excluded.size,
+                    created_at = excluded.created_at,
+                    accessed_at = excluded.accessed_at
+            """, (key, response, len(response.encode("utf-8")), now, now))
+            self._conn.execute("DELETE FROM response WHERE created_at < ?", (now - self.ttl,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk the entries from the least recently read and drop them until the rest fits
+                evicted = []
+                for old_key, size in self._conn.execute("SELECT key, size FROM response ORDER BY accessed_at"):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM response WHERE key = ?", evicted)
+                increment("llm_cache.evictions", len(evicted))
+            self._conn.commit()
+
+    def get_or_generate(self, key, generate, bypass=False):
+        # bypass=True always generates (and stores the fresh text for later readers)
+        if not bypass:
+            response = self.get(key)
+            if response is not None:
+                return response
+        response = generate()
+        self.set(key, response)
+        return response
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,63 @@
+import re
+import zlib
+from collections import deque
+
+import numpy as np
+
+# Per-session memory of the fun facts already shown, for near-duplicate detection without putting
+# the history in the prompt. Each fact is reduced to a MinHash signature of its character
+# shingles; the share of equal signature slots estimates the Jaccard similarity of two facts, so
+# rephrasings of the same fact are caught as well as exact repeats. Only the most recent
+# `max_facts` signatures are kept, so memory per session is fixed.
+
+FUN_FACT_HISTORY = 20
+MINHASH_PERMUTATIONS = 64
+SHINGLE_CHARS = 5
+DUPLICATE_SIMILARITY = 0.35  # estimated Jaccard similarity above which a fact counts as a repeat
+
+# Random hash functions (a * h + b) mod p; with h, a, b below p = 2**31 - 1 the products fit in uint64
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def _normalize(text):
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+def _shingles(text):
+    text = _normalize(text)
+    if len(text) <= SHINGLE_CHARS:
+        return {text}
+    return {text[i:i + SHINGLE_CHARS] for i in range(len(text) - SHINGLE_CHARS + 1)}
+
+def minhash(text):
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) % _MERSENNE_PRIME for shingle in _shingles(text)), dtype=np.uint64)
+    return ((np.outer(hashes, _A) + _B) % _MERSENNE_PRIME).min(axis=0)
+
+def similarity(signature, other):
+    return float(np.mean(signature == other))
+
+class FunFactIndex:
+
+    def __init__(self, max_facts=FUN_FACT_HISTORY, threshold=DUPLICATE_SIMILARITY):
+        self.threshold = threshold
+        self._facts = deque(maxlen=max_facts)  # (normalized text, fact, signature), oldest first
+
+    def __len__(self):
+        return len(self._facts)
+
+    def __contains__(self, text):
+        normalized = _normalize(text)
+        return any(seen == normalized for seen, _, _ in self._facts)
+
+    def near_duplicate(self, text):
+        # The most similar fact already shown if it is close enough to count as a repeat, else None
+        if not self._facts:
+            return None
+        signature = minhash(text)
+        score, fact = max((similarity(signature, seen), fact) for _, fact, seen in self._facts)
+        return fact if score >= self.threshold else None
+
+    def add(self, text):
+        if text.strip() and text not in self:
+            self._facts.append((_normalize(text), text, minhash(text)))
@@ -0,0 +1,94 @@
+import math
+
+import pandas as pd
+
+# Bounded-size text summary of a filtered price/budget frame for the LLM prompts. Prompt length
+# drives CPU inference latency, and to_string() grows with every row and column; the digest keeps
+# the most informative lines (per-metric ranges, best/worst cities, country averages) in priority
+# order and stops at a hard token budget, whatever the size of the frame.
+
+DIGEST_MAX_TOKENS = 600
+DIGEST_TOP_K = 3
+DIGEST_MAX_COUNTRIES = 10
+CHARS_PER_TOKEN = 4  # rough average for English text and numbers with common tokenizers
+
+# Metrics a reader cares about first, when present; any other numeric column follows
+PRIORITY_METRICS = [
+    "Monthly Savings",
+    "Monthly Savings over Income",
+    "Total Monthly Income",
+    "Total Monthly Expenses",
+    "Rent",
+    "Montlhy Rent over Income",
+    "Monthly Salary",
+    "AverageMonthlyNetSalary",
+    "Apartment1Bedroom_CityCentre",
+    "Apartment1Bedroom_OutsideCentre",
+]
+IGNORED_COLUMNS = ["Latitude", "Longitude", "data_quality"]
+
+def estimate_tokens(text, tokenizer=None):
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _metrics(df: pd.DataFrame):
+    numeric = [column for column in df.select_dtypes(include=["number"]).columns if column not in IGNORED_COLUMNS]
+    return [column for column in PRIORITY_METRICS if column in numeric] + [column for column in numeric if column not in PRIORITY_METRICS]
+
+def _place(row):
+    return f"{row['City']} ({row['Country']})" if "City" in row else str(row["Country"])
+
+def _digest_lines(df: pd.DataFrame, top_k, max_countries):
+    metrics = _metrics(df)
+    if df.empty or not metrics:
+        yield "No data selected."
+        return
+    countries = df["Country"].nunique() if "Country" in df.columns else 0
+    # Worded by aggregation level: a frame aggregated by country has no City column
+    if "City" in df.columns:
+        scope = f"{df['City'].nunique()} cities in {countries} countries"
+    elif countries:
+        scope = f"{countries} countries"
+    else:
+        scope = f"{len(df)} rows"
+    yield f"{scope}. Amounts in EUR per month, ratios in %."
+
+    primary = metrics[0]
+    df_ranked = df.dropna(subset=[primary]).sort_values(primary, ascending=False, kind="stable")
+    if not df_ranked.empty:
+        top = ", ".join(f"{_place(row)} {row[primary]:.0f}" for _, row in df_ranked.head(top_k).iterrows())
+        bottom = ", ".join(f"{_place(row)} {row[primary]:.0f}" for _, row in df_ranked.tail(top_k).iloc[::-1].iterrows())
+        yield f"Highest {primary}: {top}."
+        yield f"Lowest {primary}: {bottom}."
+
+    if "Country" in df.columns and countries > 1:
+        # observed=True: with the compact schema Country is categorical, and unselected countries
+        # would otherwise come back as empty groups
+        by_country = df.groupby("Country", observed=True)[primary].mean().sort_values(ascending=False).head(max_countries)
+        yield f"Average {primary} by country: " + ", ".join(f"{country} {value:.0f}" for country, value in by_country.items()) + "."
+
+    # One line per metric, most important first, until the budget runs out
+    for metric in metrics:
+        values = df[metric].dropna()
+        if values.empty:
+            continue
+        if values.min() == values.max():
+            yield f"{metric}: {values.min():.2f} everywhere."
+            continue
+        low, high = df.loc[values.idxmin()], df.loc[values.idxmax()]
+        yield (
+            f"{metric}: min {values.min():.2f} ({_place(low)}), median {values.median():.2f}, "
+            f"max {values.max():.2f} ({_place(high)})."
+        )
+
+def build_digest(df: pd.DataFrame, max_tokens=DIGEST_MAX_TOKENS, top_k=DIGEST_TOP_K,
+                 max_countries=DIGEST_MAX_COUNTRIES, tokenizer=None):
+    lines, used = [], 0
+    for line in _digest_lines(df.reset_index(drop=True), top_k, max_countries):
+        tokens = estimate_tokens(line + "\n", tokenizer)
+        if used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    return "\n".join(lines)
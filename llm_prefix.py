@@ -0,0 +1,107 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from dataset.metrics import increment
+
+# Key/value cache reuse for the static instructions that open every prompt. The attention keys
+# and values of a registered prefix are computed once per model and copied into each generation
+# that starts with it, so the prefill only runs over the variable suffix (page context and data).
+# Prefix and suffix are tokenized separately, so the cached tokens are exactly the ones the full
+# prompt starts with whatever the tokenizer would merge at the boundary. A batch of prompts with
+# the same prefix reuses it too: the cache is expanded to every row and the suffixes are padded on
+# the left, between prefix and suffix, which the attention mask hides (positions follow the mask).
+
+PREFIX_CACHE_MAX_ENTRIES = 8
+
+def match_prefix(prompt, prefixes):
+    # Longest of the prefixes the prompt starts with, None when it starts with none of them
+    return max((prefix for prefix in prefixes if prompt.startswith(prefix)), key=len, default=None)
+
+class PrefixCache:
+
+    def __init__(self, model, tokenizer, prefixes=(), max_entries=PREFIX_CACHE_MAX_ENTRIES):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.prefixes = sorted(prefixes, key=len, reverse=True)  # longest match first
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # prefix -> (token ids, DynamicCache)
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        for prefix in self.prefixes:
+            self._entry(prefix)
+
+    def match(self, prompt):
+        return match_prefix(prompt, self.prefixes)
+
+    def _entry(self, prefix):
+        import torch
+        from transformers import DynamicCache
+
+        with self._lock:
+            if prefix in self._entries:
+                self._entries.move_to_end(prefix)
+                increment("llm_prefix.hits")
+                return self._entries[prefix]
+            increment("llm_prefix.misses")
+            ids = self.tokenizer(prefix, return_tensors="pt").input_ids
+            with torch.no_grad():
+                cache = self.model(input_ids=ids, past_key_values=DynamicCache(), use_cache=True).past_key_values
+            self._entries[prefix] = (ids, cache)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return ids, cache
+
+    def inputs(self, prompt):
+        # Token ids of the whole prompt and a private copy of the cache for its prefix (None when
+        # no registered prefix matches); generate() appends to the cache, so it is never shared
+        import torch
+
+        prefix = self.match(prompt)
+        if prefix is None:
+            return self.tokenizer(prompt, return_tensors="pt").input_ids, None
+        prefix_ids, cache = self._entry(prefix)
+        suffix_ids = self.tokenizer(prompt[len(prefix):], return_tensors="pt", add_special_tokens=False).input_ids
+        return torch.cat([prefix_ids, suffix_ids], dim=-1), copy.deepcopy(cache)
+
+    def batch_inputs(self, prompts):
+        # Token ids and attention mask of a left-padded batch, with a private cache expanded to
+        # every row when all prompts start with the same registered prefix (None otherwise)
+        import torch
+
+        prefixes = {self.match(prompt) for prompt in prompts}
+        prefix = prefixes.pop() if len(prefixes) == 1 else None
+        if prefix is None:
+            encoded = self.tokenizer(prompts, return_tensors="pt", padding=True)
+            return encoded.input_ids, encoded.attention_mask, None
+        prefix_ids, cache = self._entry(prefix)
+        suffixes = self.tokenizer([prompt[len(prefix):] for prompt in prompts], return_tensors="pt", padding=True, add_special_tokens=False)
+        prefix_ids = prefix_ids.expand(len(prompts), -1)
+        cache = copy.deepcopy(cache)
+        cache.batch_repeat_interleave(len(prompts))
+        input_ids = torch.cat([prefix_ids, suffixes.input_ids], dim=-1)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids), suffixes.attention_mask], dim=-1)
+        return input_ids, attention_mask, cache
+
+    def generate(self, prompt, **generate_kwargs):
+        import torch
+
+        input_ids, cache = self.inputs(prompt)
+        return self.model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=cache,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **generate_kwargs,
+        )
+
+    def generate_batch(self, prompts, **generate_kwargs):
+        input_ids, attention_mask, cache = self.batch_inputs(prompts)
+        return self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=cache,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **generate_kwargs,
+        )
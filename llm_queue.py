@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from dataset.metrics import increment, observe
+
+# Process-wide inference worker. Sessions submit prompts to a bounded queue instead of running the
+# model themselves; a single worker thread takes them round-robin across sessions (so one busy
+# session can't starve the others), groups compatible prompts of different sessions into a batch
+# and runs the batch on the backend. A full queue rejects new requests at once (backpressure) and
+# requests that waited longer than their timeout fail instead of running late.
+
+INFERENCE_MAX_QUEUE = 32
+INFERENCE_MAX_PER_SESSION = 4
+INFERENCE_MAX_BATCH = 4
+INFERENCE_BATCH_WAIT = 0.02  # seconds the worker waits for more prompts to fill a batch
+INFERENCE_TIMEOUT = 120.0  # seconds a request may wait in the queue
+
+class QueueFull(Exception):
+    pass
+
+class InferenceRequest:
+
+    def __init__(self, prompt, session_id, max_new_tokens, on_text=None, cancelled=None, timeout=INFERENCE_TIMEOUT,
+                 batch_key=None):
+        self.prompt = prompt
+        self.session_id = session_id
+        self.max_new_tokens = max_new_tokens
+        # Only requests with the same batch_key share a batch (e.g. the prompt prefix whose cache the backend reuses)
+        self.batch_key = batch_key
+        self.on_text = on_text
+        self.cancelled = cancelled or threading.Event()
+        self.timeout = timeout
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.text = ""
+        self.error = None
+        self.done = threading.Event()
+
+    def emit(self, text):
+        self.text += text
+        if self.on_text is not None:
+            self.on_text(text)
+
+    def finish(self, error=None):
+        self.error = error
+        self.done.set()
+
+    def wait(self, timeout=None):
+        # Blocks until the request is done; returns the generated text or raises its error
+        if not self.done.wait(timeout):
+            raise TimeoutError("Inference request still running")
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+class InferenceQueue:
+
+    def __init__(self, backend, max_queue=INFERENCE_MAX_QUEUE, max_per_session=INFERENCE_MAX_PER_SESSION,
+                 max_batch=INFERENCE_MAX_BATCH, batch_wait=INFERENCE_BATCH_WAIT):
+        self.backend = backend
+        self.max_queue = max_queue
+        self.max_per_session = max_per_session
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.rejected = 0
+        self.timed_out = 0
+        self.batches = 0
+        self._sessions = OrderedDict()  # session id -> deque of requests, in round-robin order
+        self._size = 0
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._work, name="llm-inference", daemon=True)
+        self._worker.start()
+
+    def submit(self, request):
+        with self._condition:
+            pending = self._sessions.get(request.session_id)
+            if self._size >= self.max_queue or (pending is not None and len(pending) >= self.max_per_session):
+                self.rejected += 1
+                increment("llm_queue.rejected")
+                raise QueueFull(f"Inference queue full ({self._size} requests waiting)")
+            self._sessions.setdefault(request.session_id, deque()).append(request)
+            self._size += 1
+            self._condition.notify()
+        return request
+
+    def qsize(self):
+        with self._condition:
+            return self._size
+
+    def _take_batch(self):
+        # Round-robin over sessions: at most one request from each, so the prompts a session sends
+        # together (the sidebar's summary and fun fact) run one after the other, each streamed on
+        # its own, and a batch only ever holds different sessions. Only prompts with the same
+        # generation settings and batch key as the first one join the batch. Called with the lock held.
+        batch = []
+        now = time.perf_counter()
+        for session_id in list(self._sessions):
+            queue = self._sessions[session_id]
+            # Requests cancelled or timed out while waiting are dropped, the next one takes their turn
+            while queue and (queue[0].cancelled.is_set() or now - queue[0].submitted_at > queue[0].timeout):
+                request = queue.popleft()
+                self._size -= 1
+                if request.cancelled.is_set():
+                    request.finish()
+                else:
+                    self.timed_out += 1
+                    increment("llm_queue.timed_out")
+                    request.finish(TimeoutError(f"Inference request waited more than {request.timeout:.0f}s"))
+            if not queue or len(batch) == self.max_batch:
+                continue
+            request = queue[0]
+            if batch and (request.max_new_tokens, request.batch_key) != (batch[0].max_new_tokens, batch[0].batch_key):
+                continue
+            batch.append(queue.popleft())
+            self._size -= 1
+            # The served session goes to the back of the rotation
+            self._sessions.move_to_end(session_id)
+        for session_id in [session_id for session_id, queue in self._sessions.items() if not queue]:
+            del self._sessions[session_id]
+        return batch
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._size:
+                    self._condition.wait()
+                # Give concurrent sessions a moment to add prompts to this batch
+                if self._size < self.max_batch and self.batch_wait:
+                    self._condition.wait(self.batch_wait)
+                batch = self._take_batch()
+            if not batch:
+                continue
+            self.batches += 1
+            start = time.perf_counter()
+            for request in batch:
+                request.started_at = start
+                observe("llm_queue.wait", start - request.submitted_at)
+            increment("llm_queue.batches")
+            increment("llm_queue.batched_requests", len(batch))
+            try:
+                self.backend.generate_batch(batch)
+                for request in batch:
+                    request.finish()
+            except Exception as e:
+                for request in batch:
+                    request.finish(e)
+
+class FakeBackend:
+    # Offline stand-in model for load tests. Decoding is simulated step by step: each step emits
+    # one word to every request in the batch and costs step_seconds, plus batch_overhead for every
+    # extra prompt in the batch, so batching trades a little latency for throughput as on a CPU.
+
+    def __init__(self, step_seconds=0.01, prefill_seconds_per_1k_chars=0.01, batch_overhead=0.15, words=None):
+        self.step_seconds = step_seconds
+        self.prefill_seconds_per_1k_chars = prefill_seconds_per_1k_chars
+        self.batch_overhead = batch_overhead
+        self.words = words or ["Cost", "of", "living", "varies", "a", "lot", "across", "Europe."]
+
+    def generate_batch(self, batch):
+        time.sleep(self.prefill_seconds_per_1k_chars * max(len(request.prompt) for request in batch) / 1000)
+        step = self.step_seconds * (1 + self.batch_overhead * (len(batch) - 1))
+        for i in range(max(request.max_new_tokens for request in batch)):
+            active = [request for request in batch if i < request.max_new_tokens and not request.cancelled.is_set()]
+            if not active:
+                break
+            time.sleep(step)
+            for request in active:
+                request.emit(self.words[i % len(self.words)] + " ")
+
+class TransformersBackend:
+    # The local transformers model. A single prompt goes through `stream`, a batch through
+    # `stream_batch` in one generate() call; both stream every row token by token and stop a row
+    # once its request is cancelled, see _stream_pipeline and _stream_batch_pipeline in llm.py.
+
+    def __init__(self, stream, stream_batch):
+        self.stream = stream
+        self.stream_batch = stream_batch
+
+    def generate_batch(self, batch):
+        if len(batch) == 1:
+            request = batch[0]
+            self.stream(request.prompt, request.emit, request.cancelled, request.max_new_tokens)
+            return
+        self.stream_batch(
+            [request.prompt for request in batch],
+            [request.emit for request in batch],
+            [request.cancelled for request in batch],
+            batch[0].max_new_tokens,
+        )
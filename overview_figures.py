@@ -0,0 +1,332 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from dataset.cache import LRUCache
+from dataset.country_shapes import BUNDLED_COUNTRY_CODES, COUNTRY_ISO3, get_country_shapes
+from dataset.gazetteer import COUNTRY_CODES
+
+# Figures of the Overview page, shared by every session. Building a figure with plotly express and
+# restyling it takes tens of milliseconds, so each one is cached on the filter state (dataset
+# version, aggregation, metric, countries, slider range); an unchanged state reuses the same
+# figure object, which also serializes to the same spec, so Streamlit sends the browser a
+# reference to the message it already has instead of the whole figure. For a new state the
+# styled base figure of the (aggregation, metric) pair is copied and only its traces and the
+# data-dependent layout (map center and zoom, ranking height) are set.
+#
+# Past MAP_WEBGL_MIN_POINTS cities the SVG geo map gets too slow in the browser, and the City view
+# switches to a WebGL scattermap. Its points are first thinned on the server: the cities are
+# binned in a grid of MAP_CLUSTER_PIXELS pixel cells at the zoom the map opens with, and each
+# cell with several cities becomes one marker on its most central city, colored by the cell mean.
+# Zooming in by filtering countries or values therefore brings back the detail.
+
+FIGURE_CACHE_MAX_ENTRIES = 256
+COLORSCALE = px.colors.diverging.RdYlBu
+PERCENT_DIMENSIONS = ["Saving Rate", "Rent vs Income"]
+
+MAP_WEBGL_MIN_POINTS = 2_000
+MAP_MAX_POINTS = 5_000  # cells are widened until the thinned map has at most this many markers
+MAP_CLUSTER_PIXELS = 6
+MAP_WIDTH_PIXELS, MAP_HEIGHT_PIXELS = 700, 500  # assumed map size, for the opening zoom
+# "white-bg" needs no tile server; "carto-positron" or "open-street-map" add a basemap when the
+# browser can reach the tile servers
+MAP_STYLE = "white-bg"
+
+# Figures keyed on the filter state, and the styled empty figures they are copied from
+figure_cache = LRUCache(FIGURE_CACHE_MAX_ENTRIES, name="overview_figures")
+base_figure_cache = LRUCache(max_entries=64, name="overview_base_figures")
+
+def _state_key(kind, version, aggregation, dimension, countries, value_range):
+    return (kind, version, aggregation, dimension, tuple(sorted(countries or [])), tuple(value_range or []))
+
+def _template_frame(column):
+    # One placeholder row: plotly express lays out the same traces as for the real data
+    return pd.DataFrame({"Country": ["-"], "City": ["-"], "Latitude": [0.0], "Longitude": [0.0], column: [0.0]})
+
+def _base_map(aggregation, dimension, column):
+    df_template = _template_frame(column)
+    if aggregation == "City":
+        fig_map = px.scatter_geo(
+            df_template,
+            lat="Latitude",
+            lon="Longitude",
+            color=column,
+            color_continuous_scale=COLORSCALE,
+            center={
+                "lat":52,
+                "lon":12
+            },
+            projection="kavrayskiy7",
+            height=500,
+        )
+        unit = "%" if dimension in PERCENT_DIMENSIONS else " €"
+        fig_map.update_traces(
+            hovertemplate=(
+                "%{customdata[1]}, %{customdata[0]}<br>" +
+                f"<b>%{{customdata[2]}}{unit}</b>"
+            ),
+        )
+    else:
+        # Plotly's own geometry by alpha-3 code, plus a trace with the bundled outlines of the
+        # countries it lacks, on the same color axis; see dataset/country_shapes.py
+        fig_map = px.choropleth(
+            df_template,
+            locations="Country",
+            locationmode="ISO-3",
+            color=column,
+            color_continuous_scale=COLORSCALE,
+            center={
+                "lat":52,
+                "lon":12
+            },
+            projection="kavrayskiy7",
+            height=600,
+            title=f"{dimension} by {aggregation} - Map View",
+        )
+        fig_map.update_geos(
+            projection_scale=4
+        )
+        fig_map.add_trace(go.Choropleth(geojson=get_country_shapes(), featureidkey="id", locations=[], z=[], coloraxis="coloraxis"))
+        fig_map.update_traces(
+            hovertemplate=(
+                "%{customdata[0]}<br>" +
+                f"<b>%{{z:.2f}}%</b>"
+            ),
+        )
+        # The template's per-trace defaults only cover trace types this map does not draw; dropping
+        # them more than pays for the outline trace
+        fig_map.layout.template.data = go.layout.template.Data()
+
+    fig_map.update_geos(
+        bgcolor="rgba(0,0,0,0)",
+        showland=True, landcolor="LightGrey",
+        showcoastlines=True, coastlinecolor="Grey",
+        showsubunits=False, subunitcolor="Black",
+        showocean=True, oceancolor="LightBlue",
+        showframe=False, framecolor="Black",
+        showcountries=True, countrycolor="Grey",
+    )
+    fig_map.update_layout(
+        coloraxis_colorbar=dict(
+            orientation="h",
+            xanchor="center",
+            y=-0.2,
+            len=1,
+            title=dimension
+        )
+    )
+    return fig_map
+
+def _mercator(lat, lon, zoom):
+    # Web Mercator pixel coordinates at the given zoom level
+    world = 256 * 2 ** zoom
+    lat = np.radians(np.clip(lat, -85, 85))
+    x = (lon + 180) / 360 * world
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * world
+    return x, y
+
+def _opening_view(lat, lon):
+    # Center and zoom level that fit all the points in a MAP_WIDTH_PIXELS x MAP_HEIGHT_PIXELS map
+    x, y = _mercator(lat, lon, 0)
+    zoom_x = np.log2(MAP_WIDTH_PIXELS / max(x.max() - x.min(), 1e-6))
+    zoom_y = np.log2(MAP_HEIGHT_PIXELS / max(y.max() - y.min(), 1e-6))
+    zoom = float(np.clip(np.floor(min(zoom_x, zoom_y) * 2) / 2, 0, 12))
+    center = {"lat": (lat.max() + lat.min()) / 2, "lon": (lon.max() + lon.min()) / 2}
+    return center, zoom
+
+def thin_points(df: pd.DataFrame, column, zoom, cell_pixels=MAP_CLUSTER_PIXELS, max_points=MAP_MAX_POINTS):
+    # One row per occupied grid cell: the city nearest to the cell centroid, with the mean metric
+    # of the cell and "+N more" appended to its name
+    lat, lon = df["Latitude"].to_numpy(dtype=float), df["Longitude"].to_numpy(dtype=float)
+    x, y = _mercator(lat, lon, zoom)
+    while True:
+        column_cells, row_cells = (x // cell_pixels).astype(np.int64), (y // cell_pixels).astype(np.int64)
+        _, cell, counts = np.unique(column_cells * (row_cells.max() + 1) + row_cells, return_inverse=True, return_counts=True)
+        if len(counts) <= max_points:
+            break
+        cell_pixels *= 2
+    mean_x = np.bincount(cell, x) / counts
+    mean_y = np.bincount(cell, y) / counts
+    distance = (x - mean_x[cell]) ** 2 + (y - mean_y[cell]) ** 2
+    # For each cell, the first row in (cell, distance) order is its most central city
+    order = np.lexsort((distance, cell))
+    representative = order[np.r_[True, cell[order][1:] != cell[order][:-1]]]
+
+    df_thinned = df.iloc[representative][["Country", "City", "Latitude", "Longitude"]].copy()
+    df_thinned[column] = (np.bincount(cell, df[column].to_numpy(dtype=float)) / counts).round(2)[cell[representative]]
+    more = counts[cell[representative]] - 1
+    df_thinned["City"] = np.where(more > 0, df_thinned["City"].astype(str) + " +" + more.astype(str) + " more", df_thinned["City"].astype(str))
+    return df_thinned
+
+def _base_webgl_map(dimension, column):
+    fig_map = px.scatter_map(
+        _template_frame(column),
+        lat="Latitude",
+        lon="Longitude",
+        color=column,
+        color_continuous_scale=COLORSCALE,
+        map_style=MAP_STYLE,
+        height=500,
+    )
+    unit = "%" if dimension in PERCENT_DIMENSIONS else " €"
+    fig_map.update_traces(
+        hovertemplate=(
+            "%{customdata[1]}, %{customdata[0]}<br>" +
+            f"<b>%{{customdata[2]}}{unit}</b>"
+        ),
+    )
+    fig_map.update_layout(
+        margin=dict(l=0, r=0, t=0, b=0),
+        coloraxis_colorbar=dict(
+            orientation="h",
+            xanchor="center",
+            y=-0.2,
+            len=1,
+            title=dimension
+        )
+    )
+    return fig_map
+
+def _webgl_map(df_filtered, dimension, column):
+    fig_map = go.Figure(base_figure_cache.get_or_compute(("webgl_map", dimension), lambda: _base_webgl_map(dimension, column)))
+    df_located = df_filtered.dropna(subset=["Latitude", "Longitude"])
+    if df_located.empty:
+        return fig_map
+    center, zoom = _opening_view(df_located["Latitude"].to_numpy(dtype=float), df_located["Longitude"].to_numpy(dtype=float))
+    df_thinned = thin_points(df_located, column, zoom)
+    fig_map.update_traces(
+        lat=df_thinned["Latitude"],
+        lon=df_thinned["Longitude"],
+        marker_color=df_thinned[column],
+        customdata=df_thinned[["Country", "City", column]].to_numpy(),
+    )
+    # Cell means span a narrower range than the cities, so the colors keep the cities' range
+    values = df_located[column]
+    fig_map.update_layout(map_center=center, map_zoom=zoom, coloraxis_cmin=values.min(), coloraxis_cmax=values.max())
+    return fig_map
+
+def map_figure(version, df_filtered, aggregation, dimension, column, countries, value_range, max_lat_diff):
+    # max_lat_diff is the latitude span of the whole dataset, the reference for the zoom level
+    def build():
+        if aggregation == "City" and len(df_filtered) >= MAP_WEBGL_MIN_POINTS:
+            return _webgl_map(df_filtered, dimension, column)
+        base = base_figure_cache.get_or_compute(("map", aggregation, dimension), lambda: _base_map(aggregation, dimension, column))
+        fig_map = go.Figure(base)
+        if aggregation == "City":
+            fig_map.update_traces(
+                lat=df_filtered["Latitude"],
+                lon=df_filtered["Longitude"],
+                marker_color=df_filtered[column],
+                customdata=df_filtered[["Country", "City", column]].to_numpy(),
+            )
+            if not df_filtered.empty:
+                mid_lat = (df_filtered["Latitude"].max() + df_filtered["Latitude"].min()) / 2
+                mid_lon = (df_filtered["Longitude"].max() + df_filtered["Longitude"].min()) / 2
+                max_lat_diff_filtered = df_filtered["Latitude"].max() - df_filtered["Latitude"].min()
+                lat_ratio = max_lat_diff_filtered / max_lat_diff
+
+                fig_map.update_geos(
+                    center={
+                        "lat": mid_lat,
+                        "lon": mid_lon
+                    },
+                    projection_scale=max(4, round(25 - 21 * lat_ratio))
+                )
+        else:
+            country_codes = df_filtered["Country"].map(COUNTRY_CODES)
+            bundled = country_codes.isin(BUNDLED_COUNTRY_CODES)
+            fig_map.data[0].update(
+                locations=country_codes[~bundled].map(COUNTRY_ISO3),
+                z=df_filtered.loc[~bundled, column],
+                customdata=df_filtered.loc[~bundled, ["Country"]],
+            )
+            fig_map.data[1].update(
+                locations=country_codes[bundled],
+                z=df_filtered.loc[bundled, column],
+                customdata=df_filtered.loc[bundled, ["Country"]],
+            )
+        return fig_map
+
+    key = _state_key("map", version, aggregation, dimension, countries, value_range)
+    return figure_cache.get_or_compute(key, build)
+
+def _base_ranking(dimension, column):
+    fig_bar = px.bar(
+        _template_frame(column),
+        x=column,
+        y=["-"],
+        orientation="h",
+        color=column,
+        color_continuous_scale=COLORSCALE,
+        text_auto=True
+    )
+    fig_bar.update_layout(
+        yaxis=dict(
+            tickmode="linear",
+            tick0=0,
+            dtick=1
+        ),
+        xaxis_title="",
+        yaxis_title="",
+        dragmode=False,
+    )
+
+    if dimension in PERCENT_DIMENSIONS:
+        fig_bar.update_xaxes(ticksuffix="%")
+    else:
+        fig_bar.update_xaxes(ticksuffix="€")
+
+    fig_bar.update_traces(
+        hovertemplate=None,
+        hoverinfo='skip'
+    )
+
+    fig_bar.update_coloraxes(showscale=False)
+    fig_bar.update_xaxes(side="top")
+    return fig_bar
+
+def ranking_figure(version, df_filtered, aggregation, dimension, column, countries, value_range):
+    def build():
+        base = base_figure_cache.get_or_compute(("ranking", dimension), lambda: _base_ranking(dimension, column))
+        fig_bar = go.Figure(base)
+        df_filtered_bar = df_filtered.sort_values(column, ascending=True)
+
+        # create different y depending on segmented aggr
+        if aggregation == "City":
+            fig_bar_y = [f"{i} - {city}, {country}" for i, city, country in zip(df_filtered_bar.index, df_filtered_bar["City"], df_filtered_bar["Country"])]
+        else:
+            fig_bar_y = [f"{i} - {country}" for i, country in zip(df_filtered_bar.index, df_filtered_bar["Country"])]
+
+        fig_bar.update_traces(x=df_filtered_bar[column], y=fig_bar_y, marker_color=df_filtered_bar[column])
+        fig_bar.update_layout(height=max(300, len(df_filtered[column].unique()) * 50))
+        return fig_bar
+
+    key = _state_key("ranking", version, aggregation, dimension, countries, value_range)
+    return figure_cache.get_or_compute(key, build)
+
+def _base_distribution(aggregation, dimension, column):
+    fig_hist = px.histogram(
+        _template_frame(column),
+        x=column,
+        nbins=20,
+        marginal="box",
+        histfunc="avg",
+        title=f"{dimension} by {aggregation} - Distribution"
+    )
+    fig_hist.update_layout(
+        xaxis_title=dimension,
+        yaxis_title=f"Number of {aggregation}",
+    )
+    return fig_hist
+
+def distribution_figure(version, df_filtered, aggregation, dimension, column, countries, value_range):
+    def build():
+        base = base_figure_cache.get_or_compute(("distribution", aggregation, dimension), lambda: _base_distribution(aggregation, dimension, column))
+        fig_hist = go.Figure(base)
+        # The histogram and its box marginal both take the metric values
+        fig_hist.update_traces(x=df_filtered[column])
+        return fig_hist
+
+    key = _state_key("distribution", version, aggregation, dimension, countries, value_range)
+    return figure_cache.get_or_compute(key, build)
@@ -2,15 +2,22 @@ import pandas as pd
 import streamlit as st
 import plotly.express as px
 
-from dataset.preprocessing import FILEPATH_PRICES_PROCESSED, BUDGET_DEFAULT, calculate_budget_df
+from dataset.metrics import PhaseTimer
+from dataset.preprocessing import BUDGET_DEFAULT
+from dataset.store import get_budget_df, get_dataset
+from llm import render_sidebar
 
-df = pd.read_csv(FILEPATH_PRICES_PROCESSED)
+phases = PhaseTimer("simulator")
+phases.phase("load")
+df = get_dataset("prices").df
 
 st.header("🗺️ EuroNomad Navigator")
 st.write("Your EU City Cost & Budget Guide!")
 
-df_1 = calculate_budget_df(df, BUDGET_DEFAULT)
-df_2 = calculate_budget_df(df, BUDGET_DEFAULT)
+# Memoized per (dataset version, budget): selecting countries/cities never recomputes
+phases.phase("aggregate")
+df_1 = get_budget_df(st.session_state.get("budget", BUDGET_DEFAULT))
+df_2 = df_1
 
 # create a modal dialog to input all the info with the same structure of BUDGET DEFAULT
 budget = {}
@@ -71,8 +78,7 @@ def configure_budget():
     
     with col2:
         if st.button("Save", type="primary", icon=":material/save:", use_container_width=True):
-            df_1 = calculate_budget_df(df, budget)
-            df_2 = calculate_budget_df(df, budget)
+            st.session_state.budget = dict(budget)
             st.rerun()
     
     with col3:
@@ -82,6 +88,7 @@ def configure_budget():
 if st.button("Configure your monthly budget", type="primary", icon=":material/edit_square:"):
     configure_budget()
 
+phases.phase("filter")
 col1, col2 = st.columns([0.5, 0.5], gap="large")
 
 with col1:
@@ -110,6 +117,7 @@ with col2:
         
 col1, col2 = st.columns([0.5, 0.5], gap="medium")
 
+phases.phase("aggregate")
 if df_1.empty:
     df_1_income = 0
     df_1_expenses = 0
@@ -144,6 +152,7 @@ with col1:
         st.metric(label="Monthly Savings", value=f"{df_1_savings:.0f} €", delta=f"{savings_diff:.0f} €")
     
     # sunburst chart to show income, and savings with a proper hierarchy to budget items
+    phases.phase("figure")
     if not df_1.empty:
         fig_sunburst_1 = px.sunburst(
             names=["Income", "Expenses", "Savings"] + [
@@ -177,6 +186,7 @@ with col1:
             ],
             title=f"Budget in {selectbox_city_1}"
         )
+        phases.phase("render")
         st.plotly_chart(fig_sunburst_1, key="fig_sunburst_1")
     else:
         st.write("Select a city to see the budget")
@@ -196,6 +206,7 @@ with col2:
     with col_c:
         st.metric(label="Monthly Savings", value=f"{df_2_savings:.0f} €")
     
+    phases.phase("figure")
     if not df_2.empty:
         fig_pie_2 = px.pie(
             df_2,
@@ -225,6 +236,11 @@ with col2:
             ],
             title=f"Expenses in {selectbox_city_2}"
         )
+        phases.phase("render")
         st.plotly_chart(fig_pie_2, key="fig_pie_2")
     else:
         st.write("Select a city to see the expenses")
+
+phases.done()
+
+render_sidebar(pd.concat([df_1, df_2]).drop_duplicates(), "a comparison of monthly budgets between selected countries")